@@ -4,12 +4,38 @@ from __future__ import absolute_import
 from ._version import get_versions
 
 from .sparkapi import CiscoSparkAPI, Room, Person, Membership, Message, Webhook
+from .cache import SQLiteCache
+from .directory import PeopleDirectory
+from .dispatch import EventDispatcher, ANY, BLOCK, DROP_NEWEST, \
+    DROP_OLDEST
+from .hedging import HedgingPolicy
 from .jsondata import JSONData, READ_ONLY, READ_WRITE
+from .membershipindex import MembershipIndex
+from .messagestore import MessageStore
+from .mirror import WorkspaceMirror
+from .pagecache import PageCache
+from .pool import CiscoSparkAPIPool
+from .ratelimit import RateLimiter, SharedRateLimiter
+from .restapi import AdaptivePageSize, Deadline
+from .scheduling import AdaptiveConcurrencyLimiter, PriorityScheduler, \
+    INTERACTIVE, NORMAL, BULK
+from .search import MessageIndex
+from .sync import MessageSync, WorkspaceSync
+from .webhooks import WebhookInvalidator
 
 
 __author__ = 'Chris Lunsford <chrlunsf@cisco.com>'
 __all__ = ['CiscoSparkAPI', 'Room', 'Person', 'Membership', 'Message',
-           'Webhook', 'JSONData', 'READ_ONLY', 'READ_WRITE']
+           'Webhook', 'JSONData', 'READ_ONLY', 'READ_WRITE', 'RateLimiter',
+           'SharedRateLimiter', 'PriorityScheduler',
+           'AdaptiveConcurrencyLimiter', 'INTERACTIVE', 'NORMAL', 'BULK',
+           'HedgingPolicy', 'Deadline', 'CiscoSparkAPIPool',
+           'AdaptivePageSize', 'MessageSync',
+           'WorkspaceSync', 'SQLiteCache', 'WorkspaceMirror',
+           'WebhookInvalidator', 'MembershipIndex',
+           'MessageIndex', 'PeopleDirectory',
+           'MessageStore', 'PageCache', 'EventDispatcher', 'ANY', 'BLOCK',
+           'DROP_NEWEST', 'DROP_OLDEST']
 
 __version__ = get_versions()['version']
 del get_versions
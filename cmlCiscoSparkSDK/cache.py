@@ -0,0 +1,327 @@
+"""Persistent caching of Cisco Spark objects."""
+from __future__ import absolute_import
+from builtins import object
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import json
+import os
+import threading
+import time
+import zlib
+
+from .concurrency import concurrent_map, DEFAULT_CONCURRENCY
+from .fileio import atomic_file
+from .sqlitedb import SQLiteDatabase
+
+
+# Module constants
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 60 * 60
+DEFAULT_MAX_ENTRIES = 100000
+EVICTION_INTERVAL = 1000
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+SNAPSHOT_HEADER = 'cmlCiscoSparkSDK cache snapshot 1'
+# The resources looked up by id through the cache; others are not stored
+CACHED_RESOURCES = ('people', 'rooms', 'memberships', 'teams')
+
+
+class SQLiteCache(object):
+    """An on-disk cache of Cisco Spark objects' JSON data.
+
+    Entries are keyed by resource type (e.g. 'people', 'rooms') and id, and
+    stored with the time they were fetched.  Entries older than `ttl`
+    seconds (never, if ttl is None) are treated as missing, and the oldest
+    entries are evicted once there are more than max_entries.  Up to
+    max_entries recently used entries are also kept in memory; with
+    warm_up=True fresh entries are loaded into memory when the cache is
+    opened.
+
+    For a fast start, dump_snapshot() writes the fresh entries to a
+    compressed snapshot file, which a new process can load (see
+    load_snapshot, or the `snapshot` argument) with a single read.  Entries
+    loaded in bulk are only decoded when they are first used.
+
+    Pass a cache to CiscoSparkAPI(cache=...) to have get_person, get_room,
+    get_team and get_membership consult it, and listings and changes made
+    through the API keep it up to date.
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 warm_up=False, snapshot=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._db = SQLiteDatabase(path)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._puts = 0
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entities ('
+                       'resource TEXT, id TEXT, json TEXT, fetched REAL, '
+                       'PRIMARY KEY (resource, id))')
+            db.execute('CREATE INDEX IF NOT EXISTS entities_fetched '
+                       'ON entities (fetched)')
+        if warm_up:
+            self.warm_up()
+        if snapshot is not None and os.path.exists(snapshot):
+            self.load_snapshot(snapshot)
+
+    def _fresh(self, fetched):
+        return self.ttl is None or time.time() - fetched < self.ttl
+
+    def _remember(self, key, entry):
+        """Keep an entry in memory as the most recently used (under lock)."""
+        self._memory.pop(key, None)
+        self._memory[key] = entry
+        self._trim()
+
+    def _trim(self):
+        """Drop the least recently used entries beyond max_entries."""
+        memory = self._memory
+        while len(memory) > self.max_entries:
+            memory.popitem(last=False)
+
+    def warm_up(self):
+        """Load all fresh entries into memory."""
+        rows = self._db.execute('SELECT resource, id, json, fetched '
+                                'FROM entities ORDER BY fetched').fetchall()
+        with self._lock:
+            for resource, id, json_str, fetched in rows:
+                if self._fresh(fetched):
+                    # Decoded when first used
+                    self._memory[(resource, id)] = (json_str, fetched)
+            self._trim()
+
+    def dump_snapshot(self, path):
+        """Atomically write the fresh entries to a snapshot file."""
+        # Oldest first, so that the newest entries are kept in memory by a
+        # cache with fewer max_entries
+        rows = self._db.execute('SELECT resource, id, json, fetched '
+                                'FROM entities ORDER BY fetched').fetchall()
+        lines = [SNAPSHOT_HEADER]
+        lines.extend('%s\t%s\t%r\t%s' % (resource, id, fetched, json_str)
+                     for resource, id, json_str, fetched in rows
+                     if self._fresh(fetched))
+        with atomic_file(path, 'wb') as f:
+            f.write(zlib.compress('\n'.join(lines).encode('utf-8')))
+        return len(lines) - 1
+
+    def load_snapshot(self, path):
+        """Load a snapshot's fresh entries into memory.
+
+        Entries older than those already cached (in memory or on disk) are
+        skipped.  Returns the number of entries loaded.
+        """
+        with open(path, 'rb') as f:
+            lines = zlib.decompress(f.read()).decode('utf-8').split('\n')
+        if lines[0] != SNAPSHOT_HEADER:
+            raise ValueError("Not a cache snapshot: %r" % path)
+        cutoff = time.time() - self.ttl if self.ttl is not None else None
+        stored = dict(((resource, id), fetched) for resource, id, fetched
+                      in self._db.execute('SELECT resource, id, fetched '
+                                          'FROM entities'))
+        memory = self._memory
+        loaded = 0
+        with self._lock:
+            for line in lines[1:]:
+                resource, id, fetched, json_str = line.split('\t', 3)
+                fetched = float(fetched)
+                if cutoff is not None and fetched <= cutoff:
+                    continue
+                key = (resource, id)
+                entry = memory.get(key)
+                if fetched <= stored.get(key, 0) \
+                        or (entry is not None and fetched <= entry[1]):
+                    continue
+                memory.pop(key, None)
+                memory[key] = (json_str, fetched)
+                loaded += 1
+            self._trim()
+        return loaded
+
+    def get(self, resource, id):
+        """Return the cached JSON dictionary, or None if missing or stale."""
+        key = (resource, id)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not isinstance(entry[0], dict):
+                    entry = (json.loads(entry[0]), entry[1])
+                self._remember(key, entry)
+        if entry is None:
+            row = self._db.execute('SELECT json, fetched FROM entities '
+                                   'WHERE resource = ? AND id = ?',
+                                   (resource, id)).fetchone()
+            if row is not None:
+                entry = (json.loads(row[0]), row[1])
+                with self._lock:
+                    self._remember(key, entry)
+        with self._lock:
+            if entry is not None and self._fresh(entry[1]):
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, resource, json_dict):
+        self.put_many(resource, [json_dict])
+
+    def put_many(self, resource, json_dicts):
+        if resource not in CACHED_RESOURCES:
+            return
+        fetched = time.time()
+        rows = [(resource, json_dict['id'], json.dumps(json_dict), fetched)
+                for json_dict in json_dicts]
+        with self._db.transaction() as db:
+            db.executemany('INSERT OR REPLACE INTO entities '
+                           'VALUES (?, ?, ?, ?)', rows)
+        with self._lock:
+            memory = self._memory
+            for json_dict in json_dicts:
+                key = (resource, json_dict['id'])
+                memory.pop(key, None)
+                memory[key] = (json_dict, fetched)
+            self._trim()
+            self._puts += len(rows)
+            evict = self._puts >= EVICTION_INTERVAL
+            if evict:
+                self._puts = 0
+        if evict:
+            self.evict()
+
+    def delete(self, resource, id):
+        self._db.execute('DELETE FROM entities WHERE resource = ? AND id = ?',
+                         (resource, id))
+        with self._lock:
+            self._memory.pop((resource, id), None)
+
+    def evict(self):
+        """Drop the oldest entries beyond max_entries."""
+        with self._db.transaction() as db:
+            count = db.execute('SELECT COUNT(*) FROM entities').fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return
+            evicted = db.execute('SELECT resource, id FROM entities '
+                                 'ORDER BY fetched LIMIT ?',
+                                 (excess,)).fetchall()
+            db.executemany('DELETE FROM entities '
+                           'WHERE resource = ? AND id = ?', evicted)
+        with self._lock:
+            for key in evicted:
+                self._memory.pop(tuple(key), None)
+
+    def clear(self):
+        self._db.execute('DELETE FROM entities')
+        with self._lock:
+            self._memory.clear()
+
+    def apply_change(self, resource, event, data):
+        """Update the cache for a change to a Cisco Spark object.
+
+        event is 'created', 'updated' or 'deleted', and data is the JSON
+        dictionary of the object (only its id is needed when deleted).
+        Changes to resources that are not cached are ignored.
+        """
+        if resource not in CACHED_RESOURCES:
+            return
+        if event == DELETED:
+            self.delete(resource, data['id'])
+        else:
+            self.put(resource, data)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                    'memory_entries': len(self._memory)}
+
+
+class LookupCache(object):
+    """An in-memory cache in front of a lookup function, caching misses too.
+
+    lookup(key) returns a value, or None if there is none.  Values are
+    cached for `ttl` seconds and misses (None) for negative_ttl seconds, so
+    unknown keys are not looked up again on every call.  Concurrent lookups
+    of the same key share a single call to lookup, and the least recently
+    used entries are dropped beyond max_entries.
+    """
+    def __init__(self, lookup, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    self._entries.pop(key)
+                    self._entries[key] = entry
+                    if value is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return value
+            self.misses += 1
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = self.lookup(key)
+        except Exception as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        self.put(key, value)
+        with self._lock:
+            del self._pending[key]
+        future.set_result(value)
+        return value
+
+    def get_many(self, keys, concurrency=DEFAULT_CONCURRENCY):
+        """Look up several keys, concurrently; returns a {key: value} dict."""
+        keys = list(keys)
+        values = concurrent_map(self.get, keys, concurrency=concurrency)
+        return dict(zip(keys, values))
+
+    def put(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {'hits': self.hits, 'negative_hits': self.negative_hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits + self.negative_hits)
+                    / lookups if lookups else 0.0,
+                    'entries': len(self._entries)}
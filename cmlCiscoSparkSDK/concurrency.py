@@ -0,0 +1,185 @@
+"""Helpers for running API calls concurrently."""
+from __future__ import absolute_import
+from builtins import object
+
+from collections import deque, OrderedDict
+from concurrent.futures import (ThreadPoolExecutor, Future, wait,
+                                FIRST_COMPLETED)
+import functools
+import inspect
+import threading
+
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
+
+
+# Module constants
+DEFAULT_CONCURRENCY = 10
+DEFAULT_MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_WINDOW = 0.01
+
+
+# Helper functions
+def call_with_args(func, args):
+    """Call func with args; tuples are positional args, dicts are kwargs."""
+    if isinstance(args, tuple):
+        result = func(*args)
+    elif isinstance(args, dict):
+        result = func(**args)
+    else:
+        result = func(args)
+    if isinstance(result, Iterator):
+        # Listing methods return iterators; page through them on the worker
+        result = list(result)
+    return result
+
+
+def accepts_deadline(func):
+    """Whether func takes a `deadline` keyword argument."""
+    try:
+        return 'deadline' in inspect.signature(func).parameters
+    except AttributeError:
+        # Python 2
+        return 'deadline' in inspect.getargspec(func).args
+    except (TypeError, ValueError):
+        return False
+
+
+def with_deadline(func, deadline, signature=None):
+    """Pass deadline to each call of func, if func (or signature) takes one.
+
+    So that calls left running when a map's deadline expires stop at the
+    deadline too, rather than go on using up the request budget.
+    """
+    if deadline is not None and accepts_deadline(signature or func):
+        return functools.partial(func, deadline=deadline)
+    return func
+
+
+def _result(future, return_exceptions):
+    if return_exceptions:
+        exception = future.exception()
+        if exception is not None:
+            return exception
+    return future.result()
+
+
+def concurrent_map(func, iterable_of_args, concurrency=DEFAULT_CONCURRENCY,
+                   ordered=True, return_exceptions=False, deadline=None):
+    """Call func for each item in iterable_of_args on a bounded worker pool.
+
+    Results are yielded as they become available; in input order if ordered
+    is True, otherwise in completion order.  Input is consumed lazily, with
+    at most `concurrency` calls in flight at any time.  If return_exceptions
+    is True, exceptions are yielded in place of results; otherwise the first
+    exception is raised and any calls not yet started are cancelled.  If a
+    deadline is given, iteration stops when it expires (marking the
+    deadline partial), abandoning any calls still in flight (see
+    with_deadline to have them stop too).
+    """
+    assert concurrency >= 1
+    args_iter = iter(iterable_of_args)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+
+    def submit_next():
+        for args in args_iter:
+            if deadline is not None and deadline.expired():
+                deadline.partial = True
+                return False
+            pending.append(executor.submit(call_with_args, func, args))
+            return True
+        return False
+
+    try:
+        while len(pending) < concurrency and submit_next():
+            pass
+        while pending:
+            timeout = deadline.remaining() if deadline is not None else None
+            if ordered:
+                done, _ = wait([pending[0]], timeout=timeout)
+            else:
+                done, _ = wait(pending, timeout=timeout,
+                               return_when=FIRST_COMPLETED)
+            if not done:
+                deadline.partial = True
+                return
+            future = done.pop()
+            pending.remove(future)
+            result = _result(future, return_exceptions)
+            submit_next()
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class BatchLoader(object):
+    """Coalesce individual lookups into batched calls (dataloader pattern).
+
+    Keys submitted from any thread within batch_window seconds of each other
+    are collected and resolved with a single call to batch_fn, which receives
+    a list of up to max_batch_size keys and returns a dictionary mapping keys
+    to values.  Keys missing from the returned dictionary raise KeyError.
+    """
+    def __init__(self, batch_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 batch_window=DEFAULT_BATCH_WINDOW):
+        assert max_batch_size >= 1
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def submit(self, key):
+        """Queue a key for loading and return a Future for its value."""
+        with self._lock:
+            if self._batch is None:
+                self._batch = OrderedDict()
+                timer = threading.Timer(self.batch_window,
+                                        self._dispatch, args=(self._batch,))
+                timer.daemon = True
+                timer.start()
+            batch = self._batch
+            future = batch.get(key)
+            if future is None:
+                future = batch[key] = Future()
+            if len(batch) >= self.max_batch_size:
+                # Batch is full; resolve it now rather than waiting
+                self._batch = None
+                thread = threading.Thread(target=self._resolve,
+                                          args=(batch,))
+                thread.daemon = True
+                thread.start()
+        return future
+
+    def load(self, key):
+        return self.submit(key).result()
+
+    def load_many(self, keys):
+        futures = [self.submit(key) for key in keys]
+        return [future.result() for future in futures]
+
+    def _dispatch(self, batch):
+        with self._lock:
+            if self._batch is not batch:
+                # Already dispatched as a full batch
+                return
+            self._batch = None
+        self._resolve(batch)
+
+    def _resolve(self, batch):
+        try:
+            results = self.batch_fn(list(batch.keys()))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(KeyError(key))
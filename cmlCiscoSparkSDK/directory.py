@@ -0,0 +1,191 @@
+"""A read-only people directory file, shared by memory mapping."""
+from __future__ import absolute_import
+from builtins import object
+
+from collections import OrderedDict
+import json
+import mmap
+import struct
+import zlib
+
+from .fileio import atomic_file
+from .sparkapi import Person, spark_datetime_str
+
+
+# Module constants
+DIRECTORY_MAGIC = b'CSPD'
+DIRECTORY_VERSION = 1
+# Header: magic, version, number of people, hash table size
+HEADER = struct.Struct('<4sIII')
+# Record: (offset, length) of the id, email, displayName and JSON strings
+RECORD = struct.Struct('<QIQIQIQI')
+SLOT = struct.Struct('<I')
+ID, EMAIL, DISPLAY_NAME, JSON = range(4)
+
+
+# Helper functions
+def key_hash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+
+def hash_table_size(count):
+    """The smallest power of two at least twice count."""
+    size = 1
+    while size < 2 * count:
+        size *= 2
+    return size
+
+
+def person_strings(person):
+    if isinstance(person, Person):
+        person = person._json_dict()
+    emails = person.get('emails') or ['']
+    return [person['id'], emails[0].lower(), person.get('displayName', ''),
+            json.dumps(person, default=spark_datetime_str)]
+
+
+class DirectoryEntry(object):
+    """A person in a PeopleDirectory, read from the mapped file on access."""
+    __slots__ = ('_directory', '_index')
+
+    def __init__(self, directory, index):
+        self._directory = directory
+        self._index = index
+
+    @property
+    def id(self):
+        return self._directory._string(self._index, ID)
+
+    @property
+    def email(self):
+        return self._directory._string(self._index, EMAIL)
+
+    @property
+    def displayName(self):
+        return self._directory._string(self._index, DISPLAY_NAME)
+
+    def person(self, api=None, return_type=Person):
+        """The full Person object (this decodes the person's JSON data)."""
+        return return_type(json.loads(self._directory._string(self._index,
+                                                              JSON)),
+                           api=api)
+
+    def __repr__(self):
+        return '<DirectoryEntry %s %s>' % (self.id, self.email)
+
+
+class PeopleDirectory(object):
+    """A read-only snapshot of people, indexed by id and email address.
+
+    PeopleDirectory.build() writes a snapshot file from Person objects
+    (e.g. from get_people), and any number of processes can then open it.
+    The file is memory mapped read-only, so the processes share a single
+    copy in the page cache; put it on a tmpfs such as /dev/shm to keep it
+    in shared memory.  Lookups probe the file's hash tables of ids and
+    (lower-cased) email addresses and read only the strings asked for;
+    nothing is deserialized up front.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count, self._table_size = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != DIRECTORY_MAGIC or version != DIRECTORY_VERSION:
+            raise ValueError("Not a people directory file: %r" % path)
+        self._records = HEADER.size
+        self._id_table = self._records + self._count * RECORD.size
+        self._email_table = self._id_table + self._table_size * SLOT.size
+
+    @classmethod
+    def build(cls, path, people):
+        """Write a directory of people (Person objects or JSON dicts).
+
+        The file at path is replaced atomically, so processes can keep
+        using a previous snapshot while a new one is written.  Returns the
+        new directory.
+        """
+        # The last occurrence of each person is kept
+        records = OrderedDict()
+        for person in people:
+            strings = person_strings(person)
+            records.pop(strings[ID], None)
+            records[strings[ID]] = strings
+        records = list(records.values())
+        count = len(records)
+        table_size = hash_table_size(count)
+        heap_offset = HEADER.size + count * RECORD.size \
+            + 2 * table_size * SLOT.size
+        heap = []
+        record_data = []
+        offset = heap_offset
+        for strings in records:
+            fields = []
+            for string in strings:
+                data = string.encode('utf-8')
+                heap.append(data)
+                fields.extend((offset, len(data)))
+                offset += len(data)
+            record_data.append(RECORD.pack(*fields))
+        tables = []
+        for field in (ID, EMAIL):
+            table = [0] * table_size
+            for index, strings in enumerate(records):
+                key = strings[field].encode('utf-8')
+                if not key:
+                    continue
+                slot = key_hash(key) & (table_size - 1)
+                while table[slot]:
+                    slot = (slot + 1) & (table_size - 1)
+                table[slot] = index + 1
+            tables.append(struct.pack('<%dI' % table_size, *table))
+        with atomic_file(path, 'wb') as f:
+            f.write(HEADER.pack(DIRECTORY_MAGIC, DIRECTORY_VERSION, count,
+                                table_size))
+            for data in record_data + tables + heap:
+                f.write(data)
+        return cls(path)
+
+    def _field(self, index, field):
+        fields = RECORD.unpack_from(self._map,
+                                    self._records + index * RECORD.size)
+        return fields[2 * field], fields[2 * field + 1]
+
+    def _string(self, index, field):
+        offset, length = self._field(index, field)
+        return self._map[offset:offset + length].decode('utf-8')
+
+    def _lookup(self, table, field, key):
+        key = key.encode('utf-8')
+        mask = self._table_size - 1
+        slot = key_hash(key) & mask
+        while True:
+            entry = SLOT.unpack_from(self._map, table + slot * SLOT.size)[0]
+            if not entry:
+                return None
+            offset, length = self._field(entry - 1, field)
+            if length == len(key) \
+                    and self._map[offset:offset + length] == key:
+                return DirectoryEntry(self, entry - 1)
+            slot = (slot + 1) & mask
+
+    def get(self, id):
+        """The DirectoryEntry for a person id, or None."""
+        return self._lookup(self._id_table, ID, id)
+
+    def get_by_email(self, email):
+        """The DirectoryEntry for an email address, or None."""
+        return self._lookup(self._email_table, EMAIL, email.lower())
+
+    def __contains__(self, id):
+        return self.get(id) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield DirectoryEntry(self, index)
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,261 @@
+"""Routing of webhook notifications to handlers running on worker pools."""
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+
+from queue import Queue, Full, Empty
+import threading
+import time
+
+from .webhooks import parse_webhook
+
+
+# Module constants
+ANY = '*'
+BLOCK = 'block'
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+OVERFLOW_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_WORKERS = 1
+# Sentinel telling a worker to stop
+_STOP = object()
+
+
+# Helper functions
+def matches_filter(webhook, filter):
+    """Whether a webhook matches a filter.
+
+    filter is None (everything matches), a function of the webhook, or a
+    dictionary of values its data must have, e.g. {'roomId': roomId}.
+    """
+    if filter is None:
+        return True
+    if callable(filter):
+        return filter(webhook)
+    data = webhook.data
+    return all(getattr(data, name, None) == value
+               for name, value in filter.items())
+
+
+class Subscription(object):
+    """A handler, its queue of notifications and its worker threads."""
+    def __init__(self, handler, resource=ANY, event=ANY, filter=None,
+                 workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 overflow=BLOCK, block_timeout=None, on_error=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        assert workers >= 1
+        self.handler = handler
+        self.resource = resource
+        self.event = event
+        self.filter = filter
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.on_error = on_error
+        self.name = getattr(handler, '__name__', repr(handler))
+        self.queued = 0
+        self.dropped = 0
+        self.handled = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+        self._queue = Queue(maxsize=queue_size)
+        self._threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, webhook):
+        """Queue a notification; returns False if it was dropped."""
+        try:
+            if self.overflow == BLOCK:
+                # Backpressure: hold up the caller until there is room
+                self._queue.put(webhook, timeout=self.block_timeout)
+            elif self.overflow == DROP_NEWEST:
+                self._queue.put_nowait(webhook)
+            else:
+                while True:
+                    try:
+                        self._queue.put_nowait(webhook)
+                        break
+                    except Full:
+                        self._drop_oldest()
+        except Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def _drop_oldest(self):
+        try:
+            oldest = self._queue.get_nowait()
+        except Empty:
+            return
+        self._queue.task_done()
+        with self._lock:
+            self.dropped += 1
+        if oldest is _STOP:
+            # Never drop a stop request
+            self._queue.put_nowait(oldest)
+
+    def _work(self):
+        while True:
+            webhook = self._queue.get()
+            try:
+                if webhook is _STOP:
+                    return
+                start = time.time()
+                try:
+                    self.handler(webhook)
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                latency = time.time() - start
+                with self._lock:
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                    if error is None:
+                        self.handled += 1
+                    else:
+                        self.errors += 1
+                if error is not None and self.on_error is not None:
+                    self.on_error(self, webhook, error)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued notification has been handled."""
+        self._queue.join()
+
+    def stop(self):
+        """Stop the workers after the queued notifications are handled."""
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def metrics(self):
+        with self._lock:
+            calls = self.handled + self.errors
+            return {'name': self.name, 'resource': self.resource,
+                    'event': self.event,
+                    'queue_depth': self._queue.qsize(),
+                    'queued': self.queued, 'dropped': self.dropped,
+                    'handled': self.handled, 'errors': self.errors,
+                    'mean_latency': self.total_latency / calls
+                    if calls else 0.0,
+                    'max_latency': self.max_latency}
+
+
+class EventDispatcher(object):
+    """Route webhook notifications to the handlers subscribed to them.
+
+    Handlers subscribe to a resource and event (either may be ANY) and,
+    optionally, a filter (see matches_filter).  Subscriptions are indexed
+    by (resource, event), so routing a notification costs four dictionary
+    lookups however many subscriptions there are.  Each subscription has
+    its own bounded queue and pool of worker threads, so a slow handler
+    only holds up its own notifications.  When a queue is full, dispatch()
+    blocks (overflow=BLOCK, the default, applying backpressure to the
+    caller), or the newest or oldest notification is dropped
+    (DROP_NEWEST, DROP_OLDEST).
+
+    dispatch() can be used as a WebhookReceiver's handler.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 overflow=BLOCK, block_timeout=None, on_error=None):
+        self.defaults = {'workers': workers, 'queue_size': queue_size,
+                         'overflow': overflow, 'block_timeout': block_timeout,
+                         'on_error': on_error}
+        self.dispatched = 0
+        self.unrouted = 0
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._subscriptions = []
+
+    def subscribe(self, handler, resource=ANY, event=ANY, filter=None,
+                  **subscription_args):
+        """Call handler(webhook) for matching notifications.
+
+        Pass workers, queue_size, overflow, block_timeout or on_error to
+        override the dispatcher's defaults.  Returns the Subscription.
+        """
+        args = dict(self.defaults, **subscription_args)
+        subscription = Subscription(handler, resource, event, filter, **args)
+        key = (resource, event)
+        with self._lock:
+            # Routes are replaced rather than changed in place, so that
+            # route() can read them without taking the lock
+            self._routes[key] = self._routes.get(key, []) + [subscription]
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            key = (subscription.resource, subscription.event)
+            routes = [route for route in self._routes[key]
+                      if route is not subscription]
+            if routes:
+                self._routes[key] = routes
+            else:
+                del self._routes[key]
+            self._subscriptions.remove(subscription)
+        subscription.stop()
+
+    def route(self, webhook):
+        """The subscriptions a notification is routed to."""
+        resource = webhook.resource
+        event = webhook.event
+        routes = self._routes
+        subscriptions = []
+        for key in ((resource, event), (resource, ANY), (ANY, event),
+                    (ANY, ANY)):
+            for subscription in routes.get(key, ()):
+                if matches_filter(webhook, subscription.filter):
+                    subscriptions.append(subscription)
+        return subscriptions
+
+    def dispatch(self, payload):
+        """Queue a notification (JSON, dict or Webhook) for its handlers.
+
+        Returns the number of handlers it was queued for.
+        """
+        webhook = parse_webhook(payload)
+        subscriptions = self.route(webhook)
+        with self._lock:
+            self.dispatched += 1
+            if not subscriptions:
+                self.unrouted += 1
+        return sum(1 for subscription in subscriptions
+                   if subscription.put(webhook))
+
+    def join(self):
+        """Wait until every queued notification has been handled."""
+        for subscription in list(self._subscriptions):
+            subscription.join()
+
+    def close(self):
+        """Handle the queued notifications, then stop all workers."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self._routes = {}
+            del self._subscriptions[:]
+        for subscription in subscriptions:
+            subscription.stop()
+
+    def metrics(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            metrics = {'dispatched': self.dispatched,
+                       'unrouted': self.unrouted}
+        metrics['subscriptions'] = [subscription.metrics()
+                                    for subscription in subscriptions]
+        return metrics
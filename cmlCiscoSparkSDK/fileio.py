@@ -0,0 +1,26 @@
+"""Safe writing of files shared with other processes."""
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import os
+import tempfile
+
+
+# Helper functions
+@contextmanager
+def atomic_file(path, mode='w'):
+    """Write a file that atomically replaces the file at path when closed."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, path)
+        else:
+            os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,133 @@
+"""Hedged requests to cut tail latency on idempotent calls."""
+from __future__ import absolute_import
+from builtins import object
+
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+import threading
+import time
+
+
+# Module constants
+DEFAULT_PERCENTILE = 95
+DEFAULT_BUDGET = 0.05
+DEFAULT_MIN_DELAY = 0.01
+DEFAULT_WINDOW = 1000
+DEFAULT_MIN_SAMPLES = 20
+RECALCULATE_INTERVAL = 50
+
+
+# Helper functions
+def run_in_thread(func, *args):
+    """Call func(*args) on a new daemon thread, returning a Future."""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+class HedgingPolicy(object):
+    """When, and how often, to send a duplicate of a slow request.
+
+    A hedge is sent once a request has been outstanding for longer than the
+    given percentile of recently observed latencies (but never sooner than
+    min_delay), and only while hedges amount to no more than `budget` (a
+    fraction) of the requests sent through the policy.  No hedges are sent
+    until min_samples latencies have been observed.
+    """
+    def __init__(self, percentile=DEFAULT_PERCENTILE, budget=DEFAULT_BUDGET,
+                 min_delay=DEFAULT_MIN_DELAY, window=DEFAULT_WINDOW,
+                 min_samples=DEFAULT_MIN_SAMPLES):
+        assert 0 < percentile < 100
+        assert 0 <= budget <= 1
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._since_recalculated = 0
+        self._delay = None
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._since_recalculated += 1
+
+    def delay(self):
+        """Seconds to wait before hedging, or None if not yet known."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            if self._delay is None \
+                    or self._since_recalculated >= RECALCULATE_INTERVAL:
+                latencies = sorted(self._latencies)
+                index = int(len(latencies) * self.percentile / 100.0)
+                self._delay = max(latencies[min(index, len(latencies) - 1)],
+                                  self.min_delay)
+                self._since_recalculated = 0
+            return self._delay
+
+    def request_started(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self):
+        """Reserve a hedge from the budget; False if it is exhausted."""
+        with self._lock:
+            if self.hedges + 1 > self.requests * self.budget:
+                return False
+            self.hedges += 1
+            return True
+
+    def hedge_won(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def metrics(self):
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges,
+                    'hedge_wins': self.hedge_wins,
+                    'hedge_win_rate': float(self.hedge_wins) / self.hedges
+                    if self.hedges else 0.0,
+                    'hedge_delay': self._delay}
+
+    def call(self, func, *args):
+        """Call func(*args), hedging with a second call if it is slow.
+
+        Returns the result of whichever call succeeds first.  func must be
+        idempotent.
+        """
+        self.request_started()
+        delay = self.delay()
+        start = time.time()
+        primary = run_in_thread(func, *args)
+        primary.add_done_callback(
+            lambda _: self.record(time.time() - start))
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.try_hedge():
+            return primary.result()
+        hedge = run_in_thread(func, *args)
+        pending = set([primary, hedge])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if primary in done and primary.exception() is None:
+                return primary.result()
+            if hedge in done and hedge.exception() is None:
+                self.hedge_won()
+                return hedge.result()
+        # Both calls failed
+        return primary.result()
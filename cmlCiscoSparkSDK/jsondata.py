@@ -21,7 +21,7 @@ def json_data_to_dict(json_data):
     if isinstance(json_data, dict):
         return json_data
     elif isinstance(json_data, basestring):
-        return json.dumps(json_data)
+        return json.loads(json_data)
     else:
         raise TypeError('json_data must be a dictionary or JSON string; '
                         'recieved: %r' % json_data)
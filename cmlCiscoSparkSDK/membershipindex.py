@@ -0,0 +1,130 @@
+"""An in-memory index of which people are members of which rooms."""
+from __future__ import absolute_import
+from builtins import object
+
+import threading
+
+from .cache import DELETED
+from .sparkapi import Membership, ROOMS_URL, MEMBERSHIPS_URL
+
+
+class MembershipIndex(object):
+    """A bidirectional room <-> person membership index.
+
+    Cisco Spark can only list memberships by room, so finding a person's
+    rooms means listing the memberships of every room.  build() does that
+    once, concurrently, after which rooms_for_person() and members() are
+    answered from memory.  Register the index in api.change_listeners (and
+    in a WebhookInvalidator's listeners) to keep it up to date incrementally.
+
+    Room and person ids are long strings; to keep large indexes compact each
+    is stored once and the index itself holds sets of small integers.
+    """
+    def __init__(self, api=None):
+        self.api = api
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._numbers = {}
+        self._ids = []
+        self._room_members = {}
+        self._person_rooms = {}
+        self._emails = {}
+        # Membership id -> (room, person), as deletes only give the id
+        self._memberships = {}
+
+    def _number(self, id):
+        number = self._numbers.get(id)
+        if number is None:
+            number = self._numbers[id] = len(self._ids)
+            self._ids.append(id)
+        return number
+
+    def _id_set(self, numbers):
+        return set(self._ids[number] for number in numbers)
+
+    def build(self, concurrency=None):
+        """(Re)build the index from the memberships of all rooms."""
+        assert self.api is not None
+        rooms = [room.id for room in self.api.get_rooms()]
+        memberships = self.api.map('get_memberships',
+                                   [{'roomId': roomId} for roomId in rooms],
+                                   concurrency=concurrency)
+        with self._lock:
+            self._clear()
+            for room_memberships in memberships:
+                for membership in room_memberships:
+                    self._add(membership._json_dict())
+
+    def add(self, membership):
+        """Add a membership (a Membership or its JSON dictionary)."""
+        if isinstance(membership, Membership):
+            membership = membership._json_dict()
+        with self._lock:
+            self._add(membership)
+
+    def _add(self, json_dict):
+        self._remove(json_dict['id'])
+        room = self._number(json_dict['roomId'])
+        person = self._number(json_dict['personId'])
+        self._memberships[json_dict['id']] = (room, person)
+        self._room_members.setdefault(room, set()).add(person)
+        self._person_rooms.setdefault(person, set()).add(room)
+        if json_dict.get('personEmail'):
+            self._emails[json_dict['personEmail'].lower()] = person
+
+    def remove(self, membership_id):
+        with self._lock:
+            self._remove(membership_id)
+
+    def _remove(self, membership_id):
+        room, person = self._memberships.pop(membership_id, (None, None))
+        if room is None:
+            return
+        self._room_members[room].discard(person)
+        self._person_rooms[person].discard(room)
+
+    def remove_room(self, roomId):
+        with self._lock:
+            room = self._numbers.get(roomId)
+            for person in self._room_members.pop(room, ()):
+                self._person_rooms[person].discard(room)
+            for membership_id, (membership_room, _) \
+                    in list(self._memberships.items()):
+                if membership_room == room:
+                    del self._memberships[membership_id]
+
+    def apply_change(self, resource, event, data):
+        if resource == MEMBERSHIPS_URL:
+            if event == DELETED:
+                self.remove(data['id'])
+            else:
+                self.add(data)
+        elif resource == ROOMS_URL and event == DELETED:
+            self.remove_room(data['id'])
+
+    def members(self, roomId):
+        """The personIds of a room's members."""
+        with self._lock:
+            room = self._numbers.get(roomId)
+            return self._id_set(self._room_members.get(room, ()))
+
+    def rooms_for_person(self, personId=None, personEmail=None):
+        """The roomIds of the rooms a person is a member of."""
+        assert personId or personEmail
+        with self._lock:
+            if personId is not None:
+                person = self._numbers.get(personId)
+            else:
+                person = self._emails.get(personEmail.lower())
+            return self._id_set(self._person_rooms.get(person, ()))
+
+    def is_member(self, roomId, personId):
+        with self._lock:
+            room = self._numbers.get(roomId)
+            person = self._numbers.get(personId)
+            return person in self._room_members.get(room, ())
+
+    def __len__(self):
+        return len(self._memberships)
@@ -0,0 +1,356 @@
+"""An append-only, memory-mapped store for large message exports."""
+from __future__ import absolute_import
+from builtins import object
+from past.builtins import basestring
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+from .directory import key_hash, hash_table_size
+from .fileio import atomic_file
+from .sparkapi import Message, spark_datetime, spark_datetime_str
+
+
+# Module constants
+ID_WIDTH = 96
+CREATED_WIDTH = 32
+# Record: id, roomId, personId and created columns, then the (offset,
+# length) of the message's text and JSON data in the heap
+RECORD = struct.Struct('<%ds%ds%ds%dsQIQI' % (ID_WIDTH, ID_WIDTH, ID_WIDTH,
+                                               CREATED_WIDTH))
+RECORDS_FILE = 'records'
+HEAP_FILE = 'heap'
+IDS_FILE = 'ids'
+WRITE_BATCH_SIZE = 1000
+IDS_MAGIC = b'CSMI'
+# Id index header: magic, hash table size, number of ids, records indexed
+IDS_HEADER = struct.Struct('<4sIQQ')
+# Id index slot: hash of the id, and its record's index + 1 (0 if empty)
+IDS_SLOT = struct.Struct('<II')
+
+
+# Helper functions
+def fixed_width(value, width):
+    data = (value or '').encode('utf-8')
+    if len(data) > width:
+        raise ValueError("Too long for a %d byte column: %r" % (width, value))
+    return data
+
+
+def record_id(records, index):
+    """The id column of a record, as bytes."""
+    offset = index * RECORD.size
+    return records[offset:offset + ID_WIDTH].rstrip(b'\0')
+
+
+def find_id(table, records, key, count):
+    """Probe an id index for key; the index of its record, or None.
+
+    Entries for records beyond count (not yet mapped) are skipped.
+    """
+    _, table_size, _, _ = IDS_HEADER.unpack_from(table, 0)
+    mask = table_size - 1
+    key_hash_value = key_hash(key)
+    slot = key_hash_value & mask
+    while True:
+        slot_hash, entry = IDS_SLOT.unpack_from(
+            table, IDS_HEADER.size + slot * IDS_SLOT.size)
+        if not entry:
+            return None
+        if slot_hash == key_hash_value and entry <= count \
+                and record_id(records, entry - 1) == key:
+            return entry - 1
+        slot = (slot + 1) & mask
+
+
+def insert_id(table, table_size, records, index):
+    """Add a record to an id index; returns 1 if its id is new, else 0.
+
+    A record whose id is already indexed replaces the earlier record.
+    """
+    key = record_id(records, index)
+    mask = table_size - 1
+    key_hash_value = key_hash(key)
+    slot = key_hash_value & mask
+    while True:
+        offset = IDS_HEADER.size + slot * IDS_SLOT.size
+        slot_hash, entry = IDS_SLOT.unpack_from(table, offset)
+        if not entry or (slot_hash == key_hash_value
+                         and record_id(records, entry - 1) == key):
+            IDS_SLOT.pack_into(table, offset, key_hash_value, index + 1)
+            return 0 if entry else 1
+        slot = (slot + 1) & mask
+
+
+def map_file(f):
+    size = os.fstat(f.fileno()).st_size
+    if not size:
+        # Empty files can't be mapped
+        return b''
+    return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+
+class StoredMessage(object):
+    """A view of a message in a MessageStore, with Message's attributes.
+
+    Attributes are read from the mapped files when accessed; the id,
+    roomId, personId, created and text attributes are read directly from
+    their columns without decoding the message's JSON data.
+    """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def _record(self):
+        return self._store._record(self._index)
+
+    def _column(self, column):
+        return self._record()[column].rstrip(b'\0').decode('utf-8') or None
+
+    @property
+    def id(self):
+        return self._column(0)
+
+    @property
+    def roomId(self):
+        return self._column(1)
+
+    @property
+    def personId(self):
+        return self._column(2)
+
+    @property
+    def created(self):
+        created = self._column(3)
+        return spark_datetime(created) if created else None
+
+    @property
+    def text(self):
+        record = self._record()
+        return self._store._heap_string(record[4], record[5])
+
+    def _json_dict(self):
+        record = self._record()
+        return json.loads(self._store._heap_string(record[6], record[7]))
+
+    def __getattr__(self, name):
+        # Other attributes (personEmail, files, ...) from the JSON data
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.message(), name)
+
+    def message(self, api=None, return_type=Message):
+        """The full Message object."""
+        return return_type(self._json_dict(), api=api)
+
+    def __repr__(self):
+        return '<StoredMessage %s>' % self.id
+
+
+class MessageStore(object):
+    """Messages appended to memory-mapped files in the directory at path.
+
+    Each message is stored as a fixed-width record of its id, roomId,
+    personId and created columns, with its text and JSON data appended to a
+    separate heap file; records are found by position (store[i]) or id
+    (store.get(id)) without reading the rest of the store, and iteration
+    yields StoredMessage views rather than loading messages into memory.
+    Ids are looked up in an on-disk hash table kept up to date by the
+    writer, so lookups don't hold every id in memory either.
+    Messages are appended in batches straight from a listing, e.g.
+    store.extend(api.get_messages(roomId, return_type=dict)), by one writer
+    at a time; any number of processes can read the store meanwhile.
+    """
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock = threading.Lock()
+        self._records_path = os.path.join(path, RECORDS_FILE)
+        self._heap_path = os.path.join(path, HEAP_FILE)
+        self._ids_path = os.path.join(path, IDS_FILE)
+        for file_path in (self._records_path, self._heap_path):
+            open(file_path, 'ab').close()
+        self._records_file = open(self._records_path, 'rb')
+        self._heap_file = open(self._heap_path, 'rb')
+        self._records_map = self._heap_map = b''
+        self._count = 0
+        self._ids_map = None
+        self._ids_stat = None
+        # Ids of records appended since the id index was last updated
+        self._tail_ids = {}
+        self._tail_start = self._tail_end = 0
+        self._remap()
+
+    def _remap(self):
+        with self._lock:
+            size = os.fstat(self._records_file.fileno()).st_size
+            count = size // RECORD.size
+            if count != self._count:
+                # Map the heap second, so that it covers every mapped record
+                self._records_map = map_file(self._records_file)
+                self._heap_map = map_file(self._heap_file)
+                self._count = count
+            return count
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._records_map, index * RECORD.size)
+
+    def _heap_string(self, offset, length):
+        return self._heap_map[offset:offset + length].decode('utf-8')
+
+    def extend(self, messages):
+        """Append messages (Message objects or JSON dicts) to the store."""
+        batch = []
+        for message in messages:
+            if isinstance(message, Message):
+                message = message._json_dict()
+            batch.append(message)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                self._append(batch)
+                batch = []
+        if batch:
+            self._append(batch)
+
+    def _append(self, json_dicts):
+        with self._lock:
+            with open(self._heap_path, 'ab') as heap, \
+                    open(self._records_path, 'r+b') as records:
+                # Drop any partial record left by an interrupted write
+                records.truncate(os.fstat(records.fileno()).st_size
+                                 // RECORD.size * RECORD.size)
+                records.seek(0, os.SEEK_END)
+                offset = os.fstat(heap.fileno()).st_size
+                record_data = []
+                for json_dict in json_dicts:
+                    created = json_dict.get('created')
+                    if created is not None \
+                            and not isinstance(created, basestring):
+                        created = spark_datetime_str(created)
+                    text = (json_dict.get('text') or '').encode('utf-8')
+                    data = json.dumps(json_dict,
+                                      default=spark_datetime_str)
+                    data = data.encode('utf-8')
+                    record_data.append(RECORD.pack(
+                        fixed_width(json_dict['id'], ID_WIDTH),
+                        fixed_width(json_dict.get('roomId'), ID_WIDTH),
+                        fixed_width(json_dict.get('personId'), ID_WIDTH),
+                        fixed_width(created, CREATED_WIDTH),
+                        offset, len(text),
+                        offset + len(text), len(data)))
+                    heap.write(text)
+                    heap.write(data)
+                    offset += len(text) + len(data)
+                # Records are only written once the heap data they refer to
+                # is on disk
+                heap.flush()
+                os.fsync(heap.fileno())
+                records.write(b''.join(record_data))
+                records.flush()
+                os.fsync(records.fileno())
+                records_map = map_file(records)
+                try:
+                    self._update_ids(records_map,
+                                     len(records_map) // RECORD.size)
+                finally:
+                    records_map.close()
+
+    def _update_ids(self, records, count):
+        # Add the records appended since the last update to the id index,
+        # in place if its table has room, otherwise in a new, larger table
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, 'r+b') as f:
+                table = mmap.mmap(f.fileno(), 0)
+                try:
+                    _, table_size, entries, indexed = \
+                        IDS_HEADER.unpack_from(table, 0)
+                    if 2 * (entries + count - indexed) <= table_size:
+                        for index in range(indexed, count):
+                            entries += insert_id(table, table_size, records,
+                                                 index)
+                        IDS_HEADER.pack_into(table, 0, IDS_MAGIC, table_size,
+                                             entries, count)
+                        table.flush()
+                        return
+                finally:
+                    table.close()
+        # Leave room for the store to double before the next rebuild
+        table_size = hash_table_size(2 * count)
+        with atomic_file(self._ids_path, 'w+b') as f:
+            f.truncate(IDS_HEADER.size + table_size * IDS_SLOT.size)
+            table = mmap.mmap(f.fileno(), 0)
+            try:
+                entries = 0
+                for index in range(count):
+                    entries += insert_id(table, table_size, records, index)
+                IDS_HEADER.pack_into(table, 0, IDS_MAGIC, table_size,
+                                     entries, count)
+                table.flush()
+            finally:
+                table.close()
+
+    def get(self, id):
+        """The StoredMessage with an id, or None."""
+        count = self._remap()
+        key = id.encode('utf-8')
+        with self._lock:
+            table = self._map_ids()
+            indexed = IDS_HEADER.unpack_from(table, 0)[3] if table else 0
+            # Records not yet in the index are the newest, so they win
+            index = self._tail_id(key, min(indexed, count), count)
+            if index is None and table:
+                index = find_id(table, self._records_map, key, count)
+        return StoredMessage(self, index) if index is not None else None
+
+    def _map_ids(self):
+        # The id index is replaced when it grows; map the current one
+        try:
+            stat = os.stat(self._ids_path)
+        except OSError:
+            return None
+        stat = (stat.st_ino, stat.st_size)
+        if stat != self._ids_stat:
+            if self._ids_map is not None:
+                self._ids_map.close()
+            with open(self._ids_path, 'rb') as f:
+                self._ids_map = map_file(f)
+            self._ids_stat = stat
+        return self._ids_map
+
+    def _tail_id(self, key, start, end):
+        if start != self._tail_start or end < self._tail_end:
+            self._tail_ids = {}
+            self._tail_start = self._tail_end = start
+        for index in range(self._tail_end, end):
+            self._tail_ids[record_id(self._records_map, index)] = index
+        self._tail_end = end
+        return self._tail_ids.get(key)
+
+    def __getitem__(self, index):
+        count = self._count
+        if not -count <= index < count:
+            count = self._remap()
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(index)
+        return StoredMessage(self, index)
+
+    def __len__(self):
+        return self._remap()
+
+    def __iter__(self):
+        for index in range(self._remap()):
+            yield StoredMessage(self, index)
+
+    def close(self):
+        for f in (self._records_map, self._heap_map, self._ids_map):
+            if isinstance(f, mmap.mmap):
+                f.close()
+        self._records_file.close()
+        self._heap_file.close()
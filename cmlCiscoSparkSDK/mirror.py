@@ -0,0 +1,243 @@
+"""A local, indexed mirror of a Cisco Spark workspace."""
+from __future__ import absolute_import
+from builtins import object
+from past.builtins import basestring
+
+import json
+
+from .cache import DELETED
+from .sparkapi import Room, Membership, Message, Team, TeamMembership, \
+    ROOMS_URL, MEMBERSHIPS_URL, MESSAGES_URL, TEAMS_URL, \
+    TEAM_MEMBERSHIPS_URL, spark_datetime, spark_datetime_str
+from .sqlitedb import SQLiteDatabase, SYNC_STATE_TABLE, get_sync_state, \
+    set_sync_state
+from .sync import MessageSync, WorkspaceSync
+
+
+# Module constants
+# Table name, indexed columns and data object class for each resource
+MIRROR_TABLES = {
+    ROOMS_URL: ('rooms', ('created',), Room),
+    MEMBERSHIPS_URL: ('memberships', ('roomId', 'personId', 'personEmail',
+                                      'created'), Membership),
+    MESSAGES_URL: ('messages', ('roomId', 'personId', 'personEmail',
+                                'created'), Message),
+    TEAMS_URL: ('teams', ('created',), Team),
+    TEAM_MEMBERSHIPS_URL: ('team_memberships', ('teamId', 'personEmail',
+                                                'created'), TeamMembership),
+}
+MIRROR_RESOURCES = dict((data_class, resource) for resource, (_, _, data_class)
+                        in MIRROR_TABLES.items())
+
+
+# Helper functions
+def where_equal(**values):
+    return [('%s = ?' % column, value)
+            for column, value in sorted(values.items()) if value is not None]
+
+
+def datetime_column(value):
+    # Normalize created times, which are compared as strings in queries
+    if isinstance(value, basestring):
+        value = spark_datetime(value)
+    return spark_datetime_str(value)
+
+
+def column_value(column, value):
+    if column == 'created' and value is not None:
+        return datetime_column(value)
+    return value
+
+
+class WorkspaceMirror(object):
+    """Rooms, memberships, messages and teams in an indexed SQLite file.
+
+    Objects are ingested as they are fetched from the API and can then be
+    queried locally, by roomId, personId, personEmail and created time,
+    instead of crawling the API.  Queries return the same SparkDataObject
+    types the API methods do.  refresh() keeps the mirror up to date with
+    an incremental WorkspaceSync; the mirror can also be registered in
+    api.change_listeners to record changes made through the API.
+    """
+    def __init__(self, path, api=None):
+        self.api = api
+        self._db = SQLiteDatabase(path)
+        with self._db.transaction() as db:
+            for table, columns, _ in MIRROR_TABLES.values():
+                db.execute('CREATE TABLE IF NOT EXISTS %s ('
+                           'id TEXT PRIMARY KEY, %s, json TEXT)'
+                           % (table, ', '.join(columns)))
+                for column in columns:
+                    db.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)'
+                               % (table, column, table, column))
+            db.execute(SYNC_STATE_TABLE)
+
+    def ingest(self, data_objects, resource=None):
+        """Store (or replace) data objects, e.g. from a listing method."""
+        rows = {}
+        for data_object in data_objects:
+            object_resource = resource or MIRROR_RESOURCES[type(data_object)]
+            json_dict = data_object._json_dict()
+            rows.setdefault(object_resource, []).append(json_dict)
+        with self._db.transaction() as db:
+            for object_resource, json_dicts in rows.items():
+                self._store(db, object_resource, json_dicts)
+
+    def _store(self, db, resource, json_dicts):
+        table, columns, _ = MIRROR_TABLES[resource]
+        db.executemany('INSERT OR REPLACE INTO %s (id, %s, json) '
+                       'VALUES (?, %s, ?)'
+                       % (table, ', '.join(columns),
+                          ', '.join('?' * len(columns))),
+                       [[json_dict['id']]
+                        + [column_value(column, json_dict.get(column))
+                           for column in columns]
+                        + [json.dumps(json_dict, default=datetime_column)]
+                        for json_dict in json_dicts])
+
+    def apply_change(self, resource, event, data):
+        if resource not in MIRROR_TABLES:
+            return
+        table = MIRROR_TABLES[resource][0]
+        with self._db.transaction() as db:
+            if event == DELETED and resource == ROOMS_URL:
+                self._delete_room(db, data['id'])
+            elif event == DELETED:
+                db.execute('DELETE FROM %s WHERE id = ?' % table,
+                           (data['id'],))
+            else:
+                self._store(db, resource, [data])
+
+    def _delete_room(self, db, roomId):
+        db.execute('DELETE FROM rooms WHERE id = ?', (roomId,))
+        for child in ('memberships', 'messages'):
+            db.execute('DELETE FROM %s WHERE roomId = ?' % child, (roomId,))
+
+    def _query(self, resource, where=(), order_by='created', limit=None):
+        table, _, data_class = MIRROR_TABLES[resource]
+        sql = 'SELECT json FROM %s' % table
+        if where:
+            sql += ' WHERE ' + ' AND '.join(clause for clause, _ in where)
+        sql += ' ORDER BY %s' % order_by
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        values = [value for _, value in where]
+        for row in self._db.execute(sql, values):
+            yield data_class(json.loads(row[0]), api=self.api)
+
+    def get_room(self, id):
+        for room in self._query(ROOMS_URL, [('id = ?', id)]):
+            return room
+        return None
+
+    def rooms(self):
+        return self._query(ROOMS_URL)
+
+    def teams(self):
+        return self._query(TEAMS_URL)
+
+    def memberships(self, roomId=None, personId=None, personEmail=None):
+        where = where_equal(roomId=roomId, personId=personId,
+                            personEmail=personEmail)
+        return self._query(MEMBERSHIPS_URL, where)
+
+    def team_memberships(self, teamId=None, personEmail=None):
+        where = where_equal(teamId=teamId, personEmail=personEmail)
+        return self._query(TEAM_MEMBERSHIPS_URL, where)
+
+    def rooms_for_person(self, personId=None, personEmail=None):
+        """The rooms a person is a member of."""
+        assert personId or personEmail
+        where = where_equal(personId=personId, personEmail=personEmail)
+        sql = 'SELECT json FROM rooms WHERE id IN ' \
+              '(SELECT roomId FROM memberships WHERE %s) ORDER BY created' \
+              % ' AND '.join(clause for clause, _ in where)
+        for row in self._db.execute(sql, [value for _, value in where]):
+            yield Room(json.loads(row[0]), api=self.api)
+
+    def messages(self, roomId=None, personId=None, personEmail=None,
+                 since=None, until=None, limit=None):
+        """Messages matching all given filters, newest first.
+
+        since and until are datetimes bounding the messages' created time.
+        """
+        where = where_equal(roomId=roomId, personId=personId,
+                            personEmail=personEmail)
+        if since is not None:
+            where.append(('created >= ?', datetime_column(since)))
+        if until is not None:
+            where.append(('created < ?', datetime_column(until)))
+        return self._query(MESSAGES_URL, where, order_by='created DESC',
+                           limit=limit)
+
+    def refresh(self, concurrency=None):
+        """Bring the mirror up to date with the workspace.
+
+        Only rooms whose lastActivity has changed since the last refresh
+        have their new messages and memberships fetched.  Rooms no longer
+        listed are removed, with their memberships and messages, and each
+        team's memberships are listed afresh.  Returns the WorkspaceSync's
+        SyncReport.
+        """
+        assert self.api is not None
+        marks = get_sync_state(self._db, 'message_marks')
+        message_sync = MessageSync(self.api)
+        message_sync.marks = dict(marks)
+        workspace_sync = WorkspaceSync(self.api, message_sync=message_sync,
+                                       on_messages=self._on_messages,
+                                       on_memberships=self._on_memberships,
+                                       concurrency=concurrency,
+                                       on_rooms=self._on_rooms)
+        workspace_sync.snapshot = get_sync_state(self._db, 'room_activity')
+        report = workspace_sync.sync()
+        # Only rooms whose messages were all stored move their marks on
+        for roomId in report.refreshed:
+            if roomId in message_sync.marks:
+                marks[roomId] = message_sync.marks[roomId]
+        for roomId in list(marks):
+            if roomId not in workspace_sync.snapshot:
+                del marks[roomId]
+        set_sync_state(self._db, 'message_marks', marks)
+        set_sync_state(self._db, 'room_activity', workspace_sync.snapshot)
+        self._refresh_teams(concurrency)
+        return report
+
+    def _on_rooms(self, rooms):
+        # Rooms missing from the listing have been deleted, or left
+        roomIds = set(room.id for room in rooms)
+        with self._db.transaction() as db:
+            self._store(db, ROOMS_URL, [room._json_dict() for room in rooms])
+            for roomId, in db.execute('SELECT id FROM rooms').fetchall():
+                if roomId not in roomIds:
+                    self._delete_room(db, roomId)
+
+    def _refresh_teams(self, concurrency=None):
+        teams = list(self.api.get_teams())
+        team_memberships = self.api.map(
+            lambda team: self.api.get_team_memberships(team.id), teams,
+            concurrency=concurrency)
+        team_memberships = list(team_memberships)
+        teamIds = set(team.id for team in teams)
+        with self._db.transaction() as db:
+            self._store(db, TEAMS_URL, [team._json_dict() for team in teams])
+            for teamId, in db.execute('SELECT id FROM teams').fetchall():
+                if teamId not in teamIds:
+                    db.execute('DELETE FROM teams WHERE id = ?', (teamId,))
+            # Replace the teams' memberships, dropping any that have ended
+            db.execute('DELETE FROM team_memberships')
+            self._store(db, TEAM_MEMBERSHIPS_URL,
+                        [membership._json_dict()
+                         for memberships in team_memberships
+                         for membership in memberships])
+
+    def _on_messages(self, room, messages):
+        self.ingest(messages, MESSAGES_URL)
+
+    def _on_memberships(self, room, memberships):
+        # Replace the room's memberships, dropping any that have ended
+        with self._db.transaction() as db:
+            db.execute('DELETE FROM memberships WHERE roomId = ?', (room.id,))
+            self._store(db, MEMBERSHIPS_URL,
+                        [membership._json_dict()
+                         for membership in memberships])
+
@@ -0,0 +1,118 @@
+"""An on-disk cache of listing pages, for replaying listings offline."""
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+
+import hashlib
+import json
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+from .sqlitedb import SQLiteDatabase
+
+
+# Module constants
+DEFAULT_PAGE_MAX_AGE = 60 * 60
+CACHED_STATUS_CODE = 200
+CACHED_HEADERS = ('Content-Type', 'Link')
+
+
+# Helper functions
+def page_key(url, params=None, headers=None):
+    """Key a page by its canonical URL and the credentials in headers."""
+    url = requests.Request('GET', url, params=params).prepare().url
+    parsed_url = urlparse(url)
+    query = sorted(parse_qsl(parsed_url.query, keep_blank_values=True))
+    url = urlunparse(parsed_url._replace(query=urlencode(query)))
+    # Different credentials may see different pages
+    authorization = (headers or {}).get('Authorization') or ''
+    credentials = hashlib.sha1(authorization.encode('utf-8')).hexdigest()
+    return credentials + ' ' + url
+
+
+def cached_response(url, headers, content):
+    response = requests.Response()
+    response.status_code = CACHED_STATUS_CODE
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = 'utf-8'
+    response._content = content
+    response.from_page_cache = True
+    return response
+
+
+class PageCache(object):
+    """Compressed pages of listings, kept in a SQLite file.
+
+    Pass a PageCache to CiscoSparkAPI(page_cache=...) (or RESTfulAPI) and
+    each page fetched by a listing is stored, keyed by its URL and
+    parameters, and served from disk while it is fresh: no older than
+    max_age seconds (never stale if None), or than max_ages[resource] for
+    resources (URL paths relative to the API, e.g. 'messages') listed in
+    max_ages.  Cached pages keep their 'next' links, so a listing whose
+    pages are all cached is replayed without touching the network.  Pages
+    are keyed by their size, so listings with a fixed `max` replay best.
+    """
+    def __init__(self, path, max_age=DEFAULT_PAGE_MAX_AGE, max_ages=None):
+        self.max_age = max_age
+        self.max_ages = max_ages or {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = SQLiteDatabase(path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                       'key TEXT PRIMARY KEY, url TEXT, headers TEXT, '
+                       'content BLOB, fetched REAL)')
+
+    def _max_age(self, resource):
+        return self.max_ages.get(resource, self.max_age)
+
+    def get(self, key, resource=None):
+        """The cached response for key if fresh, otherwise None."""
+        row = self._db.execute('SELECT url, headers, content, fetched '
+                               'FROM pages WHERE key = ?',
+                               (key,)).fetchone()
+        max_age = self._max_age(resource)
+        with self._lock:
+            if row is None or (max_age is not None
+                               and time.time() - row[3] > max_age):
+                self.misses += 1
+                return None
+            self.hits += 1
+        url, headers, content, _ = row
+        return cached_response(url, json.loads(headers),
+                               zlib.decompress(bytes(content)))
+
+    def put(self, key, response):
+        if response.status_code != CACHED_STATUS_CODE:
+            return
+        headers = dict((name, response.headers[name])
+                       for name in CACHED_HEADERS if name in response.headers)
+        self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                         (key, response.url, json.dumps(headers),
+                          zlib.compress(response.content), time.time()))
+
+    def purge(self):
+        """Delete pages that are stale for every resource."""
+        max_ages = [self.max_age] + list(self.max_ages.values())
+        if None in max_ages:
+            # Some pages never go stale
+            return
+        self._db.execute('DELETE FROM pages WHERE fetched < ?',
+                         (time.time() - max(max_ages),))
+
+    def clear(self):
+        self._db.execute('DELETE FROM pages')
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0}
@@ -0,0 +1,278 @@
+"""Spread Cisco Spark API calls across several authentication tokens."""
+from __future__ import absolute_import
+from builtins import object
+
+import copy
+import functools
+import inspect
+import threading
+import time
+
+import requests
+
+from .concurrency import concurrent_map, with_deadline, DEFAULT_CONCURRENCY
+from .sparkapi import CiscoSparkAPI, JSONItemsIterator
+
+
+# Module constants
+ROUND_ROBIN = 'round-robin'
+LEAST_LOADED = 'least-loaded'
+STRATEGIES = (ROUND_ROBIN, LEAST_LOADED)
+ROOM_ID_METHODS = ('get_room', 'update_room', 'delete_room')
+# How Cisco Spark refuses a bot that is not a member of a room
+NOT_A_MEMBER_STATUS_CODES = (403, 404)
+
+
+class CiscoSparkAPIPool(object):
+    """A CiscoSparkAPI-compatible pool of clients, one per token.
+
+    Cisco Spark rate limits are per access token, so spreading calls across
+    the tokens of several bots scales throughput with the number of bots.
+    API methods called on the pool are dispatched to one of its clients,
+    chosen round-robin or least-loaded (fewest calls in flight), skipping
+    clients that are currently rate limited where possible.  Each client
+    tracks its own 429 state.
+
+    Calls that address a room (a roomId argument, or the id of
+    get_room/update_room/delete_room) stick to the client the room has been
+    assigned to, because only bots that are members of a room can use it.
+    Rooms are assigned by create_room, by assign_room, by discover_rooms, or
+    otherwise to the first client a call addressing them succeeds on.  A
+    call refused with a 403 or 404 (as when the bot is not a member) is
+    tried on the other clients in turn, and the room is no longer assigned
+    to the client that refused it; a listing is retried this way if its
+    first page is refused.
+    """
+    def __init__(self, authentication_tokens, strategy=ROUND_ROBIN,
+                 **api_args):
+        assert authentication_tokens
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy: %r" % strategy)
+        self.strategy = strategy
+        self.clients = [CiscoSparkAPI(token, **api_args)
+                        for token in authentication_tokens]
+        self._lock = threading.Lock()
+        self._room_clients = {}
+        self._in_flight = [0] * len(self.clients)
+        self._calls = [0] * len(self.clients)
+        self._next = 0
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self.clients[0], name)
+        if not callable(attr):
+            return attr
+        return functools.partial(self._call, name)
+
+    def with_priority(self, priority):
+        view = copy.copy(self)
+        view.clients = [client.with_priority(priority)
+                        for client in self.clients]
+        return view
+
+    def map(self, method, iterable_of_args, concurrency=None, ordered=True,
+            return_exceptions=False, deadline=None):
+        """Concurrently call a pool method once for each item of arguments.
+
+        As CiscoSparkAPI.map, but each call is dispatched separately, so
+        the calls are spread across the pool's tokens.
+        """
+        signature = None
+        if not callable(method):
+            # Pool methods take the arguments of the clients' methods
+            signature = getattr(self.clients[0], method)
+            method = getattr(self, method)
+        if concurrency is None:
+            concurrency = DEFAULT_CONCURRENCY * len(self.clients)
+        method = with_deadline(method, deadline, signature)
+        return concurrent_map(method, iterable_of_args,
+                              concurrency=concurrency, ordered=ordered,
+                              return_exceptions=return_exceptions,
+                              deadline=deadline)
+
+    def assign_room(self, roomId, client):
+        """Stick calls for a room to a client (one of self.clients)."""
+        with self._lock:
+            self._room_clients[roomId] = self.clients.index(client)
+
+    def discover_rooms(self):
+        """Assign each client's rooms to it, balancing shared rooms."""
+        rooms = {}
+        for index, client in enumerate(self.clients):
+            for room in client.get_rooms():
+                rooms.setdefault(room.id, []).append(index)
+        counts = [0] * len(self.clients)
+        with self._lock:
+            for roomId, indexes in rooms.items():
+                index = min(indexes, key=lambda i: counts[i])
+                counts[index] += 1
+                self._room_clients[roomId] = index
+
+    def metrics(self):
+        now = time.time()
+        with self._lock:
+            return [{'in_flight': self._in_flight[index],
+                     'calls': self._calls[index],
+                     'rate_limited': self._rate_limited(client, now),
+                     'rooms': sum(1 for i in self._room_clients.values()
+                                  if i == index)}
+                    for index, client in enumerate(self.clients)]
+
+    def _rate_limited(self, client, now):
+        return bool(client.rate_limiter) \
+            and client.rate_limiter.blocked_until() > now
+
+    def _room_id(self, name, method, args, kwargs):
+        try:
+            call_args = inspect.getcallargs(method, *args, **kwargs)
+        except TypeError:
+            return None
+        if name in ROOM_ID_METHODS:
+            return call_args.get('id')
+        return call_args.get('roomId')
+
+    def _choose_client(self, roomId, tried=()):
+        with self._lock:
+            if roomId is not None and roomId in self._room_clients \
+                    and self._room_clients[roomId] not in tried:
+                index = self._room_clients[roomId]
+            else:
+                now = time.time()
+                untried = [i for i in range(len(self.clients))
+                           if i not in tried]
+                candidates = [i for i in untried
+                              if not self._rate_limited(self.clients[i], now)]
+                candidates = candidates or untried
+                if self.strategy == LEAST_LOADED:
+                    # Ties go to the next client in round-robin order
+                    index = min(candidates, key=lambda i: (
+                        self._in_flight[i],
+                        (i - self._next) % len(self.clients)))
+                else:
+                    index = min(candidates, key=lambda i:
+                                (i - self._next) % len(self.clients))
+                self._next = (index + 1) % len(self.clients)
+            self._calls[index] += 1
+            return index
+
+    def _assign(self, roomId, index):
+        """Assign a room to the client a call for it succeeded on."""
+        if roomId is not None:
+            with self._lock:
+                self._room_clients.setdefault(roomId, index)
+
+    def _refused(self, roomId, index, tried, error):
+        """Whether a call for a room refused by a client can go to another.
+
+        The room is unassigned from the client, which is added to tried.
+        """
+        response = getattr(error, 'response', None)
+        if roomId is None or response is None \
+                or response.status_code not in NOT_A_MEMBER_STATUS_CODES:
+            return False
+        with self._lock:
+            if self._room_clients.get(roomId) == index:
+                del self._room_clients[roomId]
+        tried.append(index)
+        return len(tried) < len(self.clients)
+
+    def _started(self, index):
+        with self._lock:
+            self._in_flight[index] += 1
+
+    def _done(self, index):
+        with self._lock:
+            self._in_flight[index] -= 1
+
+    def _call(self, name, *args, **kwargs):
+        roomId = self._room_id(name, getattr(self.clients[0], name),
+                               args, kwargs)
+        tried = []
+        index, result = self._dispatch(name, args, kwargs, roomId, tried)
+        if isinstance(result, JSONItemsIterator):
+            # Listings are fetched lazily; count them in flight while they
+            # are being iterated
+            retry = functools.partial(self._dispatch, name, args, kwargs,
+                                      roomId, tried)
+            return _TrackedItems(self, index, result, roomId, tried, retry)
+        if name == 'create_room':
+            with self._lock:
+                self._room_clients[result.id] = index
+        else:
+            self._assign(roomId, index)
+        return result
+
+    def _dispatch(self, name, args, kwargs, roomId, tried):
+        while True:
+            index = self._choose_client(roomId, tried)
+            self._started(index)
+            try:
+                return index, getattr(self.clients[index], name)(*args,
+                                                                 **kwargs)
+            except requests.HTTPError as e:
+                if not self._refused(roomId, index, tried, e):
+                    raise
+            finally:
+                self._done(index)
+
+
+class _TrackedItems(object):
+    """A pool listing, counted in flight on its client while iterated."""
+    def __init__(self, pool, index, items, roomId=None, tried=None,
+                 retry=None):
+        self._pool = pool
+        self._index = index
+        self._items = items
+        self._roomId = roomId
+        self._tried = tried
+        self._retry = retry
+        self._state = None
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._state is None:
+            self._state = 'started'
+            self._pool._started(self._index)
+        while True:
+            try:
+                item = next(self._items)
+            except StopIteration:
+                self._succeeded()
+                self.close()
+                raise
+            except requests.HTTPError as e:
+                self.close()
+                if self._started or not self._pool._refused(
+                        self._roomId, self._index, self._tried, e):
+                    raise
+                # The first page was refused; list from another client
+                self._index, self._items = self._retry()
+                self._state = 'started'
+                self._pool._started(self._index)
+                continue
+            except BaseException:
+                self.close()
+                raise
+            self._succeeded()
+            return item
+
+    def _succeeded(self):
+        if not self._started:
+            self._started = True
+            self._pool._assign(self._roomId, self._index)
+
+    def __getattr__(self, name):
+        # e.g. checkpoint()
+        return getattr(self._items, name)
+
+    def close(self):
+        if self._state == 'started':
+            self._state = 'done'
+            self._pool._done(self._index)
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,125 @@
+"""Client-side handling of Cisco Spark rate limiting."""
+from __future__ import absolute_import
+from builtins import object
+
+import threading
+import time
+
+from .sqlitedb import SQLiteDatabase
+
+
+# Module constants
+RATE_LIMITED_STATUS_CODE = 429
+DEFAULT_RETRY_AFTER = 15
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_SHARED_KEY = 'default'
+
+
+# Helper functions
+def retry_after(response):
+    """Seconds to wait, as requested by a rate limited (429) response."""
+    try:
+        return max(int(response.headers.get('Retry-After')), 0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class RateLimiter(object):
+    """Rate limit state shared by every request made through an API object.
+
+    When any request is rate limited, all requests sharing the limiter pause
+    until the Retry-After period has passed; so concurrent workers back off
+    together instead of each collecting its own 429 responses.  If rate is
+    set, requests are also held to a token bucket of `rate` requests per
+    second with bursts of up to `burst` requests.
+    """
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, rate=None,
+                 burst=None):
+        assert rate is None or rate > 0
+        self.max_retries = max_retries
+        self.rate = rate
+        self.burst = burst or (max(rate, 1) if rate else None)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self._tokens = self.burst
+        self._last_refill = time.time()
+
+    def blocked_until(self):
+        with self._lock:
+            return self._blocked_until
+
+    def reserve(self):
+        """Take a request token if available, else return seconds to wait."""
+        with self._lock:
+            delay, self._tokens, self._last_refill = self._reserve(
+                time.time(), self._blocked_until, self._tokens,
+                self._last_refill)
+            return delay
+
+    def _reserve(self, now, blocked_until, tokens, last_refill):
+        # Token bucket arithmetic; returns (delay, tokens, last_refill)
+        if blocked_until > now:
+            return blocked_until - now, tokens, last_refill
+        if self.rate is None:
+            return 0, tokens, last_refill
+        elapsed = max(now - last_refill, 0)
+        tokens = min(self.burst, tokens + elapsed * self.rate)
+        if tokens >= 1:
+            return 0, tokens - 1, now
+        return (1 - tokens) / self.rate, tokens, now
+
+    def wait(self):
+        delay = self.reserve()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self.reserve()
+
+    def rate_limited(self, retry_after):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                                      time.time() + retry_after)
+
+
+class SharedRateLimiter(RateLimiter):
+    """Rate limit state shared by all processes on a host.
+
+    Token bucket and Retry-After state are kept in a SQLite database file,
+    updated under an exclusive transaction, so every process (and thread)
+    using the same path and key draws from one budget and backs off together
+    when any of them is rate limited.  Use one key per access token.
+    """
+    def __init__(self, path, key=DEFAULT_SHARED_KEY,
+                 max_retries=DEFAULT_MAX_RETRIES, rate=None, burst=None):
+        super(SharedRateLimiter, self).__init__(max_retries=max_retries,
+                                                rate=rate, burst=burst)
+        self.path = path
+        self.key = key
+        self._db = SQLiteDatabase(path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS rate_limits ('
+                       'key TEXT PRIMARY KEY, blocked_until REAL, '
+                       'tokens REAL, last_refill REAL)')
+            db.execute('INSERT OR IGNORE INTO rate_limits VALUES (?, ?, ?, ?)',
+                       (self.key, 0.0, self.burst or 0, time.time()))
+
+    def blocked_until(self):
+        row = self._db.execute('SELECT blocked_until FROM rate_limits '
+                               'WHERE key = ?', (self.key,)).fetchone()
+        return row[0]
+
+    def reserve(self):
+        with self._db.transaction() as db:
+            blocked_until, tokens, last_refill = db.execute(
+                'SELECT blocked_until, tokens, last_refill FROM rate_limits '
+                'WHERE key = ?', (self.key,)).fetchone()
+            delay, tokens, last_refill = self._reserve(
+                time.time(), blocked_until, tokens, last_refill)
+            db.execute('UPDATE rate_limits SET tokens = ?, last_refill = ? '
+                       'WHERE key = ?', (tokens, last_refill, self.key))
+            return delay
+
+    def rate_limited(self, retry_after):
+        with self._db.transaction() as db:
+            db.execute('UPDATE rate_limits '
+                       'SET blocked_until = MAX(blocked_until, ?) '
+                       'WHERE key = ?', (time.time() + retry_after, self.key))
@@ -0,0 +1,265 @@
+"""An asyncio server that receives Cisco Spark webhook notifications.
+
+This module requires Python 3.5 or later, and is not imported by the
+package; import it as cmlCiscoSparkSDK.receiver.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from .sparkapi import Webhook
+from .webhooks import parse_webhook, verify_signature, SIGNATURE_HEADER
+
+
+# Module constants
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+HANDLER_BATCH_SIZE = 64
+DEFAULT_IDLE_TIMEOUT = 60
+ACCEPTED = 204
+BAD_REQUEST = 400
+UNAUTHORIZED = 401
+NOT_FOUND = 404
+METHOD_NOT_ALLOWED = 405
+LENGTH_REQUIRED = 411
+PAYLOAD_TOO_LARGE = 413
+SERVICE_UNAVAILABLE = 503
+REASONS = {
+    ACCEPTED: 'No Content',
+    BAD_REQUEST: 'Bad Request',
+    UNAUTHORIZED: 'Unauthorized',
+    NOT_FOUND: 'Not Found',
+    METHOD_NOT_ALLOWED: 'Method Not Allowed',
+    LENGTH_REQUIRED: 'Length Required',
+    PAYLOAD_TOO_LARGE: 'Payload Too Large',
+    SERVICE_UNAVAILABLE: 'Service Unavailable',
+}
+# Complete responses, by status and whether the connection is kept alive
+RESPONSES = dict(
+    ((status, keep_alive),
+     ('HTTP/1.1 %d %s\r\nContent-Length: 0\r\nConnection: %s\r\n\r\n'
+      % (status, reason, 'keep-alive' if keep_alive else 'close'))
+     .encode('ascii'))
+    for status, reason in REASONS.items() for keep_alive in (True, False))
+
+
+# Helper functions
+def parse_head(head):
+    """Split an HTTP request head into method, target, version, headers.
+
+    Header names are lower-cased.  Raises ValueError if it is malformed.
+    """
+    request_line, _, header_block = head.partition(b'\r\n')
+    method, target, version = request_line.split()
+    headers = {}
+    for line in header_block.split(b'\r\n'):
+        name, colon, value = line.partition(b':')
+        if colon:
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+def keep_alive(version, headers):
+    connection = headers.get(b'connection', b'').lower()
+    if version == b'HTTP/1.1':
+        return connection != b'close'
+    return connection == b'keep-alive'
+
+
+class WebhookReceiver(object):
+    """Receive webhook notifications and pass them to a handler.
+
+    Each notification POSTed to `path` is checked against the webhook's
+    `secret` (if given) using its X-Spark-Signature header, parsed into a
+    Webhook (or return_type) and acknowledged at once; the handler is then
+    called with it from a queue, off the request path, so slow handlers
+    don't hold up Cisco Spark's requests.  handler may be a coroutine
+    function, called on the event loop, or a plain function (for example
+    WebhookInvalidator.handle), called on a pool of `workers` threads.
+
+    Up to queue_size notifications are queued; beyond that they are
+    refused with a 503 so that the sender knows they were not handled.
+    Connections that send nothing for idle_timeout seconds are closed.
+    """
+    def __init__(self, handler, secret=None, path='/',
+                 workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_body_size=DEFAULT_MAX_BODY_SIZE, return_type=Webhook,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.handler = handler
+        self.secret = secret
+        self.path = path.encode('utf-8')
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_body_size = max_body_size
+        self.return_type = return_type
+        self.idle_timeout = idle_timeout
+        self.received = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.dropped = 0
+        self.handled = 0
+        self.errors = 0
+        self.handler_time = 0.0
+        self._signature_header = SIGNATURE_HEADER.lower().encode('ascii')
+        self._queue = None
+        self._server = None
+        self._tasks = []
+        self._executor = None
+        self._writers = set()
+
+    async def start(self, host=None, port=8080, **server_args):
+        """Start listening; returns the asyncio Server."""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if not asyncio.iscoroutinefunction(self.handler):
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.ensure_future(self._work())
+                       for _ in range(self.workers)]
+        self._server = await asyncio.start_server(
+            self._serve, host, port, limit=MAX_HEADER_SIZE, **server_args)
+        return self._server
+
+    async def close(self):
+        """Stop listening, and finish handling the queued notifications."""
+        self._server.close()
+        # Idle keep-alive connections would otherwise hold up wait_closed
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def run(self, host=None, port=8080):
+        """Serve on the current event loop until interrupted."""
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.start(host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.close())
+
+    async def _serve(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+                except (asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                try:
+                    method, target, version, headers = parse_head(head)
+                    length = int(headers.get(b'content-length', 0))
+                except ValueError:
+                    writer.write(RESPONSES[BAD_REQUEST, False])
+                    break
+                if length < 0:
+                    writer.write(RESPONSES[BAD_REQUEST, False])
+                    break
+                if b'transfer-encoding' in headers:
+                    # Only bodies with a Content-Length are read
+                    writer.write(RESPONSES[LENGTH_REQUIRED, False])
+                    break
+                if length > self.max_body_size:
+                    writer.write(RESPONSES[PAYLOAD_TOO_LARGE, False])
+                    break
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length),
+                                                  self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                alive = keep_alive(version, headers)
+                status = self._receive(method, target, headers, body)
+                writer.write(RESPONSES[status, alive])
+                if not alive:
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _receive(self, method, target, headers, body):
+        if target.split(b'?', 1)[0] != self.path:
+            return NOT_FOUND
+        if method != b'POST':
+            return METHOD_NOT_ALLOWED
+        if self.secret is not None and not verify_signature(
+                self.secret, body, headers.get(self._signature_header)):
+            self.rejected += 1
+            return UNAUTHORIZED
+        try:
+            webhook = parse_webhook(body, return_type=self.return_type)
+        except (ValueError, TypeError):
+            self.invalid += 1
+            return BAD_REQUEST
+        try:
+            self._queue.put_nowait(webhook)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return SERVICE_UNAVAILABLE
+        self.received += 1
+        return ACCEPTED
+
+    async def _work(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self._executor is None:
+                results = [await self._call_handler(batch[0])]
+            else:
+                # Hand queued notifications to the threads in batches, to
+                # spread the cost of switching threads
+                while len(batch) < HANDLER_BATCH_SIZE \
+                        and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                results = await loop.run_in_executor(
+                    self._executor, self._call_handler_batch, batch)
+            for latency, exception in results:
+                self.handler_time += latency
+                if exception is None:
+                    self.handled += 1
+                else:
+                    self.errors += 1
+                    loop.call_exception_handler({
+                        'message': 'Webhook handler failed',
+                        'exception': exception,
+                    })
+                self._queue.task_done()
+
+    async def _call_handler(self, webhook):
+        start = time.time()
+        try:
+            await self.handler(webhook)
+        except Exception as e:
+            return time.time() - start, e
+        return time.time() - start, None
+
+    def _call_handler_batch(self, batch):
+        results = []
+        for webhook in batch:
+            start = time.time()
+            try:
+                self.handler(webhook)
+            except Exception as e:
+                results.append((time.time() - start, e))
+            else:
+                results.append((time.time() - start, None))
+        return results
+
+    def metrics(self):
+        calls = self.handled + self.errors
+        return {'received': self.received, 'rejected': self.rejected,
+                'invalid': self.invalid, 'dropped': self.dropped,
+                'handled': self.handled, 'errors': self.errors,
+                'queue_depth': self._queue.qsize() if self._queue else 0,
+                'mean_handler_latency': self.handler_time / calls
+                if calls else 0.0}
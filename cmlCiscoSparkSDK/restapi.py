@@ -1,11 +1,23 @@
 """Generic RESTful API interface class."""
+from __future__ import absolute_import
 from future import standard_library
 standard_library.install_aliases()
 from builtins import object
 
 
+import copy
+import time
+
 import requests
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, parse_qsl, urlencode, urlunparse
+
+from .pagecache import page_key
+from .ratelimit import RATE_LIMITED_STATUS_CODE, retry_after
+from .scheduling import PriorityScheduler, NORMAL
+
+
+# Module constants
+AUTO_PAGE_SIZE = 'auto'
 
 
 # Helper functions
@@ -21,9 +33,86 @@ def merge_args(args1, args2):
     return result
 
 
+def set_url_param(url, name, value):
+    """Return url with query parameter name set to value."""
+    parsed_url = urlparse(url)
+    query = [(param, param_value) for param, param_value
+             in parse_qsl(parsed_url.query, keep_blank_values=True)
+             if param != name]
+    query.append((name, str(value)))
+    return urlunparse(parsed_url._replace(query=urlencode(query)))
+
+
+class AdaptivePageSize(object):
+    """Choose the size of each page of a listing from the cost of the last.
+
+    After each page, the page size is scaled towards whichever is tighter of
+    target_latency (seconds per page) and target_bytes (response body bytes
+    per page), by at most a factor of max_step either way, and kept between
+    minimum and maximum items.
+    """
+    def __init__(self, initial=100, minimum=10, maximum=1000,
+                 target_latency=1.0, target_bytes=None, max_step=2.0):
+        assert 1 <= minimum <= initial <= maximum
+        assert target_latency or target_bytes
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+        self.max_step = max_step
+
+    def update(self, latency, num_bytes):
+        """Record the cost of a page of self.size items; return next size."""
+        factors = [self.max_step]
+        if self.target_latency and latency > 0:
+            factors.append(self.target_latency / latency)
+        if self.target_bytes and num_bytes > 0:
+            factors.append(float(self.target_bytes) / num_bytes)
+        factor = max(min(factors), 1 / self.max_step)
+        self.size = int(min(max(self.size * factor, self.minimum),
+                            self.maximum))
+        return self.size
+
+
+class Deadline(object):
+    """An overall time budget for a sequence of requests.
+
+    Pass a Deadline to a listing or bulk method to bound the whole
+    operation; each request's timeout is shrunk to the time remaining, and
+    iteration stops cleanly once the deadline expires.  `partial` is set to
+    True if an operation was cut short by the deadline.
+    """
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+        self.partial = False
+
+    def remaining(self):
+        return max(self.expires - time.time(), 0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, timeout=None):
+        """The request timeout to use, given the time remaining."""
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+        else:
+            return min(timeout, remaining)
+
+
 class RESTfulAPI(object):
-    def __init__(self, api_url, **request_args):
+    def __init__(self, api_url, rate_limiter=None, concurrency_limiter=None,
+                 hedging_policy=None, page_cache=None, **request_args):
         self.api_url = api_url
+        self.hedging_policy = hedging_policy
+        self.page_cache = page_cache
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.scheduler = PriorityScheduler(
+            rate_limiter, concurrency_limiter=concurrency_limiter)
+        self.priority = NORMAL
         self.request_args = request_args
 
     def absolute_url(self, url):
@@ -34,43 +123,148 @@ class RESTfulAPI(object):
             base_path = urlparse(self.api_url).path
             return urljoin(self.api_url, base_path + url)
 
-    def get(self, url, **request_args):
+    def relative_url(self, url):
+        base_path = urlparse(self.api_url).path
+        path = urlparse(url).path
+        if path.startswith(base_path):
+            path = path[len(base_path):]
+        return path.strip('/')
+
+    def with_priority(self, priority):
+        """Return a view of this API object that sends requests at priority.
+
+        The view shares this object's scheduler, rate limit budget and
+        request args; for example api.with_priority('interactive').
+        """
+        if priority not in self.scheduler.classes:
+            raise ValueError("Unknown priority class: %r" % priority)
+        view = copy.copy(self)
+        view.priority = priority
+        return view
+
+    def request(self, method, url, **request_args):
         url = self.absolute_url(url)
         request_args = merge_args(self.request_args, request_args)
-        response = requests.get(url, **request_args)
-        return response
+        return self._send(method, url, request_args)
+
+    def _send(self, method, url, request_args, deadline=None):
+        # All requests funnel through here; admit them in priority order
+        # within the rate limit, and wait out and retry any rate limiting
+        # (429) responses if a rate limiter has been configured.  With a
+        # deadline, returns None (marking it partial) rather than wait, or
+        # send a request, beyond it
+        retries = 0
+        while True:
+            if not self.scheduler.admit(self.priority, deadline):
+                deadline.partial = True
+                return None
+            args = request_args
+            if deadline is not None:
+                timeout = deadline.timeout(request_args.get('timeout'))
+                if timeout <= 0:
+                    # A zero timeout is invalid; the deadline has expired
+                    self.scheduler.cancel()
+                    deadline.partial = True
+                    return None
+                args = dict(request_args, timeout=timeout)
+            start = time.time()
+            try:
+                response = requests.request(method, url, **args)
+            except requests.exceptions.Timeout:
+                if deadline is not None and deadline.remaining() <= 0:
+                    # Timed out by the deadline rather than the server
+                    self.scheduler.cancel()
+                else:
+                    self.scheduler.release(time.time() - start, None)
+                raise
+            except Exception:
+                self.scheduler.release(time.time() - start, None)
+                raise
+            self.scheduler.release(time.time() - start, response.status_code)
+            if response.status_code == RATE_LIMITED_STATUS_CODE \
+                    and self.rate_limiter \
+                    and retries < self.rate_limiter.max_retries:
+                delay = retry_after(response)
+                self.rate_limiter.rate_limited(delay)
+                if deadline is not None and delay >= deadline.remaining():
+                    deadline.partial = True
+                    return None
+                retries += 1
+            else:
+                return response
 
-    def get_iter(self, url, **request_args):
+    def get(self, url, hedge=True, **request_args):
+        # GETs are idempotent; hedge them against tail latency if a hedging
+        # policy has been configured (pass hedge=False to opt a call out)
+        if hedge and self.hedging_policy:
+            url = self.absolute_url(url)
+            request_args = merge_args(self.request_args, request_args)
+            return self.hedging_policy.call(self._send, 'GET', url,
+                                            request_args)
+        return self.request('GET', url, **request_args)
+
+    def get_iter(self, url, deadline=None, next_page_size=None,
+                 **request_args):
+        # next_page_size, if given, is called with the latency and size in
+        # bytes of each page, and returns the 'max' parameter to set for the
+        # next page (or None to leave it unchanged)
         url = self.absolute_url(url)
         request_args = merge_args(self.request_args, request_args)
-        response = requests.get(url, **request_args)
-        while True:
+        start = time.time()
+        response = self._get_page(deadline, url, request_args)
+        latency = time.time() - start
+        while response is not None:
             # Yield response content
             yield response
             # Get next page
             if response.links.get('next'):
                 next_url = response.links.get('next').get('url')
+                # Cached pages are replayed exactly as they were fetched
+                if next_page_size is not None \
+                        and not getattr(response, 'from_page_cache', False):
+                    size = next_page_size(latency, len(response.content))
+                    if size is not None:
+                        next_url = set_url_param(next_url, 'max', size)
                 # Remove args that mutate next_url
                 if request_args.get('params'):
                     request_args.pop('params')
-                response = requests.get(next_url, **request_args)
+                start = time.time()
+                response = self._get_page(deadline, next_url, request_args)
+                latency = time.time() - start
             else:
-                raise StopIteration
+                return
 
-    def post(self, url, **request_args):
-        url = self.absolute_url(url)
-        request_args = merge_args(self.request_args, request_args)
-        response = requests.post(url, **request_args)
+    def _get_page(self, deadline, url, request_args):
+        # Get a page of a listing, from the page cache if it is fresh there
+        if self.page_cache is None:
+            return self._send_before(deadline, 'GET', url, request_args)
+        key = page_key(url, request_args.get('params'),
+                       request_args.get('headers'))
+        response = self.page_cache.get(key, self.relative_url(url))
+        if response is None:
+            response = self._send_before(deadline, 'GET', url, request_args)
+            if response is not None:
+                self.page_cache.put(key, response)
         return response
 
+    def _send_before(self, deadline, method, url, request_args):
+        # Send a request within the time remaining before deadline; returns
+        # None, marking the deadline partial, if it expires first
+        if deadline is None:
+            return self._send(method, url, request_args)
+        try:
+            return self._send(method, url, request_args, deadline)
+        except requests.exceptions.Timeout:
+            if deadline.expired():
+                deadline.partial = True
+                return None
+            raise
+
+    def post(self, url, **request_args):
+        return self.request('POST', url, **request_args)
+
     def put(self, url, **request_args):
-        url = self.absolute_url(url)
-        request_args = merge_args(self.request_args, request_args)
-        response = requests.put(url, **request_args)
-        return response
+        return self.request('PUT', url, **request_args)
 
     def delete(self, url, **request_args):
-        url = self.absolute_url(url)
-        request_args = merge_args(self.request_args, request_args)
-        response = requests.delete(url, **request_args)
-        return response
+        return self.request('DELETE', url, **request_args)
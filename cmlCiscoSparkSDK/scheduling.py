@@ -0,0 +1,204 @@
+"""Scheduling of requests that share a client's request budget."""
+from __future__ import absolute_import
+from builtins import object
+
+import heapq
+import itertools
+import threading
+import time
+
+
+# Module constants
+INTERACTIVE = 'interactive'
+NORMAL = 'normal'
+BULK = 'bulk'
+PRIORITY_CLASSES = (INTERACTIVE, NORMAL, BULK)
+SERVER_ERROR_STATUS_CODE = 500
+RATE_LIMITED_STATUS_CODE = 429
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """Additive-increase/multiplicative-decrease limit on requests in flight.
+
+    The limit grows by `increase` for every `limit` successful requests
+    while latency stays within `latency_tolerance` times its long-run
+    average, and is multiplied by `backoff` when a request is rate limited
+    (429), fails with a server error (5xx) or connection error, or latency
+    inflates beyond the tolerance.  Latency is judged by its recent average
+    (smoothed by latency_smoothing) against the long-run average (smoothed
+    by baseline_smoothing), not by single requests, so the ordinary tail of
+    the latency distribution is not mistaken for congestion.  At most one
+    decrease is applied
+    per `limit` requests completed, so a burst of errors from requests that
+    were already in flight is treated as a single congestion signal.
+    """
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64,
+                 increase=1.0, backoff=0.5, latency_tolerance=2.0,
+                 latency_smoothing=0.1, baseline_smoothing=0.01):
+        assert 1 <= min_limit <= initial_limit <= max_limit
+        assert 0 < backoff < 1
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.latency_smoothing = latency_smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.in_flight = 0
+        self.recent_latency = None
+        self.average_latency = None
+        self.increases = 0
+        self.decreases = 0
+        self._limit = float(initial_limit)
+        self._since_decrease = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def available(self):
+        return self.in_flight < self.limit
+
+    def acquire(self):
+        self.in_flight += 1
+
+    def release(self, latency, status_code):
+        """Record a completed request; status_code is None on failure."""
+        self.in_flight -= 1
+        self._since_decrease += 1
+        congested = status_code is None \
+            or status_code == RATE_LIMITED_STATUS_CODE \
+            or status_code >= SERVER_ERROR_STATUS_CODE
+        if status_code is not None:
+            if self.average_latency is None:
+                self.recent_latency = self.average_latency = latency
+            else:
+                self.recent_latency += \
+                    (latency - self.recent_latency) * self.latency_smoothing
+                self.average_latency += \
+                    (latency - self.average_latency) * self.baseline_smoothing
+        if not congested and self.average_latency is not None:
+            congested = self.recent_latency > \
+                self.average_latency * self.latency_tolerance
+        if congested:
+            if self._since_decrease >= self.limit:
+                self._limit = max(self._limit * self.backoff, self.min_limit)
+                self._since_decrease = 0
+                self.decreases += 1
+        else:
+            old_limit = self.limit
+            self._limit = min(self._limit + self.increase / self._limit,
+                              self.max_limit)
+            if self.limit > old_limit:
+                self.increases += 1
+
+    def cancel(self):
+        """Free the slot of a request without recording its outcome."""
+        self.in_flight -= 1
+
+    def metrics(self):
+        return {'limit': self.limit, 'in_flight': self.in_flight,
+                'recent_latency': self.recent_latency,
+                'average_latency': self.average_latency,
+                'increases': self.increases, 'decreases': self.decreases}
+
+
+class PriorityScheduler(object):
+    """Admit requests in priority order within a shared rate limit.
+
+    Requests wait in a single queue ordered by priority class (the order of
+    `classes`, highest priority first) and then by arrival; only the request
+    at the head of the queue is admitted, and only when the rate limiter
+    (if any) has budget for it.  So a backlog of bulk requests never delays
+    an interactive request by more than the request currently being
+    admitted.  If a concurrency limiter is set, requests are also only
+    admitted while it has room for another request in flight, and must be
+    released when they complete.
+    """
+    def __init__(self, rate_limiter=None, classes=PRIORITY_CLASSES,
+                 concurrency_limiter=None):
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.classes = tuple(classes)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._stats = {}
+        for priority in self.classes:
+            self._stats[priority] = {'queue_depth': 0, 'admitted': 0,
+                                     'total_wait': 0.0, 'max_wait': 0.0}
+
+    def admit(self, priority=NORMAL, deadline=None):
+        """Block until a request of the given priority class may be sent.
+
+        If a deadline is given and it would expire first, gives up and
+        returns False; otherwise returns True once admitted.
+        """
+        if priority not in self._stats:
+            raise ValueError("Unknown priority class: %r" % priority)
+        entry = (self.classes.index(priority), next(self._sequence))
+        stats = self._stats[priority]
+        start = time.time()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            stats['queue_depth'] += 1
+            try:
+                while True:
+                    remaining = deadline.remaining() \
+                        if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    limiter = self.concurrency_limiter
+                    if self._queue[0] != entry \
+                            or (limiter and not limiter.available()):
+                        self._cond.wait(remaining)
+                        continue
+                    delay = self.rate_limiter.reserve() \
+                        if self.rate_limiter else 0
+                    if delay <= 0:
+                        if limiter:
+                            limiter.acquire()
+                        break
+                    if remaining is not None and delay >= remaining:
+                        # No budget for the request before the deadline
+                        return False
+                    self._cond.wait(delay)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                stats['queue_depth'] -= 1
+                self._cond.notify_all()
+            waited = time.time() - start
+            stats['admitted'] += 1
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+            return True
+
+    def release(self, latency, status_code):
+        """Record the completion of an admitted request."""
+        if self.concurrency_limiter:
+            with self._cond:
+                self.concurrency_limiter.release(latency, status_code)
+                self._cond.notify_all()
+
+    def cancel(self):
+        """Release an admitted request that was cut short by its deadline.
+
+        Unlike release, nothing is recorded: running out of one's own time
+        is no sign of congestion.
+        """
+        if self.concurrency_limiter:
+            with self._cond:
+                self.concurrency_limiter.cancel()
+                self._cond.notify_all()
+
+    def metrics(self):
+        """Per priority class queue depth, admissions and wait times."""
+        with self._cond:
+            metrics = {}
+            for priority, stats in self._stats.items():
+                metrics[priority] = dict(stats)
+                metrics[priority]['mean_wait'] = \
+                    stats['total_wait'] / stats['admitted'] \
+                    if stats['admitted'] else 0.0
+            return metrics
@@ -0,0 +1,254 @@
+"""Local full-text search over Cisco Spark messages."""
+from __future__ import absolute_import
+from builtins import object
+
+import json
+import math
+import re
+
+from .cache import DELETED
+from .mirror import where_equal, datetime_column, column_value
+from .sparkapi import Message, ROOMS_URL, MESSAGES_URL
+from .sqlitedb import SQLiteDatabase, SYNC_STATE_TABLE, get_sync_state, \
+    set_sync_state
+from .sync import MessageSync
+
+
+# Module constants
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+INGEST_BATCH_SIZE = 500
+FILTER_COLUMNS = ('roomId', 'personId', 'personEmail', 'created')
+POSTINGS_QUERY = 'SELECT message FROM postings WHERE token = ?'
+POSTING_EXISTS = ('EXISTS (SELECT 1 FROM postings '
+                  'WHERE token = ? AND message = messages.number)')
+POSITIONS_QUERY = ('(SELECT positions FROM postings '
+                   'WHERE token = ? AND message = messages.number)')
+
+
+# Helper functions
+def tokenize(text):
+    """The lower-cased word tokens of text."""
+    return [token.lower() for token in TOKEN_PATTERN.findall(text or '')]
+
+
+def parse_query(query):
+    """Split a query into a list of phrases, each a list of tokens.
+
+    Quoted text is a phrase; every other word is a phrase of one token.
+    """
+    phrases = []
+    for quoted, word in QUERY_PATTERN.findall(query):
+        tokens = tokenize(quoted or word)
+        if tokens:
+            phrases.append(tokens)
+    return phrases
+
+
+def token_positions(tokens):
+    positions = {}
+    for position, token in enumerate(tokens):
+        positions.setdefault(token, []).append(position)
+    return positions
+
+
+def contains_phrase(positions, phrase):
+    """Whether the tokens of phrase occur consecutively.
+
+    positions maps each token to the set of its positions in the text.
+    """
+    return any(all(start + offset in positions[token]
+                   for offset, token in enumerate(phrase))
+               for start in positions[phrase[0]])
+
+
+class MessageIndex(object):
+    """An inverted index for full-text search of messages, in a SQLite file.
+
+    Messages are ingested as they are fetched (e.g. ingest(api.get_messages(
+    roomId))) or from an export, and search() then answers word and
+    "quoted phrase" queries, filtered by room, person and created time,
+    from the index rather than by scanning message text.  Each token's
+    postings list the messages it occurs in and its positions in them, so
+    phrases are matched without reading message text.  refresh() keeps the
+    index up to date incrementally; the index can also be registered in
+    api.change_listeners (and a WebhookInvalidator's listeners).
+    """
+    def __init__(self, path, api=None):
+        self.api = api
+        self._db = SQLiteDatabase(path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS messages ('
+                       'number INTEGER PRIMARY KEY, id TEXT UNIQUE, %s, '
+                       'json TEXT)' % ', '.join(FILTER_COLUMNS))
+            for column in FILTER_COLUMNS:
+                db.execute('CREATE INDEX IF NOT EXISTS messages_%s '
+                           'ON messages (%s)' % (column, column))
+            db.execute('CREATE TABLE IF NOT EXISTS postings ('
+                       'token TEXT, message INTEGER, positions TEXT, '
+                       'PRIMARY KEY (token, message)) WITHOUT ROWID')
+            db.execute(SYNC_STATE_TABLE)
+
+    def ingest(self, messages):
+        """Index (or re-index) messages: Message objects or JSON dicts.
+
+        Messages are consumed, and committed, in batches as they arrive.
+        """
+        batch = []
+        for message in messages:
+            if isinstance(message, Message):
+                message = message._json_dict()
+            batch.append(message)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                self._ingest_batch(batch)
+                batch = []
+        if batch:
+            self._ingest_batch(batch)
+
+    def _ingest_batch(self, json_dicts):
+        with self._db.transaction() as db:
+            for json_dict in json_dicts:
+                self._remove(db, 'id = ?', json_dict['id'])
+                cursor = db.execute(
+                    'INSERT INTO messages (id, %s, json) VALUES (?, %s, ?)'
+                    % (', '.join(FILTER_COLUMNS),
+                       ', '.join('?' * len(FILTER_COLUMNS))),
+                    [json_dict['id']]
+                    + [column_value(column, json_dict.get(column))
+                       for column in FILTER_COLUMNS]
+                    + [json.dumps(json_dict, default=datetime_column)])
+                positions = token_positions(tokenize(json_dict.get('text')))
+                db.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                               [(token, cursor.lastrowid,
+                                 ' '.join(str(p) for p in token_list))
+                                for token, token_list in positions.items()])
+
+    def _remove(self, db, where, value):
+        rows = db.execute('SELECT number, json FROM messages WHERE %s'
+                          % where, (value,)).fetchall()
+        for number, json_str in rows:
+            tokens = set(tokenize(json.loads(json_str).get('text')))
+            db.executemany('DELETE FROM postings '
+                           'WHERE token = ? AND message = ?',
+                           [(token, number) for token in tokens])
+            db.execute('DELETE FROM messages WHERE number = ?', (number,))
+
+    def remove(self, id):
+        with self._db.transaction() as db:
+            self._remove(db, 'id = ?', id)
+
+    def remove_room(self, roomId):
+        with self._db.transaction() as db:
+            self._remove(db, 'roomId = ?', roomId)
+
+    def apply_change(self, resource, event, data):
+        if resource == MESSAGES_URL:
+            if event == DELETED:
+                self.remove(data['id'])
+            else:
+                self.ingest([data])
+        elif resource == ROOMS_URL and event == DELETED:
+            self.remove_room(data['id'])
+
+    def search(self, query, roomId=None, personId=None, personEmail=None,
+               since=None, until=None, limit=None, return_type=Message):
+        """Messages containing every word and phrase of query, newest first.
+
+        since and until are datetimes bounding the messages' created time.
+        With a limit, candidates are read only until enough have matched,
+        and when every word is common the messages are walked newest first
+        rather than collecting all of each word's postings.
+        """
+        phrases = parse_query(query)
+        if not phrases:
+            return
+        tokens = sorted(set(token for phrase in phrases for token in phrase))
+        where = where_equal(roomId=roomId, personId=personId,
+                            personEmail=personEmail)
+        if since is not None:
+            where.append(('created >= ?', datetime_column(since)))
+        if until is not None:
+            where.append(('created < ?', datetime_column(until)))
+        phrases = [phrase for phrase in phrases if len(phrase) > 1]
+        # The positions of phrases' tokens are read along with each message
+        phrase_tokens = sorted(set(token for phrase in phrases
+                                   for token in phrase))
+        sql = 'SELECT json%s FROM messages WHERE ' \
+              % ''.join(', ' + POSITIONS_QUERY for _ in phrase_tokens)
+        if limit is not None and self._common(tokens, limit):
+            sql += ' AND '.join([POSTING_EXISTS] * len(tokens))
+        else:
+            sql += 'number IN (%s)' \
+                % ' INTERSECT '.join([POSTINGS_QUERY] * len(tokens))
+        for clause, _ in where:
+            sql += ' AND ' + clause
+        sql += ' ORDER BY created DESC'
+        values = phrase_tokens + tokens + [value for _, value in where]
+        if limit is not None and not phrases:
+            sql += ' LIMIT %d' % limit
+        # Read the matches before yielding them, so that the database is
+        # not held open while the caller iterates
+        matches = []
+        for row in self._db.execute(sql, values):
+            if limit is not None and len(matches) >= limit:
+                break
+            if phrases:
+                positions = dict(
+                    (token, set(int(p) for p in token_positions.split()))
+                    for token, token_positions in zip(phrase_tokens, row[1:]))
+                if not all(contains_phrase(positions, phrase)
+                           for phrase in phrases):
+                    continue
+            matches.append(row[0])
+        for json_str in matches:
+            yield return_type(json.loads(json_str), api=self.api)
+
+    def _common(self, tokens, limit):
+        """Whether every token is in enough messages that `limit` matches
+        are found sooner by walking messages than by reading postings.
+
+        Walking reads about limit * N / n messages for a token in n of N
+        messages, so that is cheaper once n exceeds sqrt(limit * N).
+        Postings are counted only up to that threshold.
+        """
+        messages = self._db.execute('SELECT MAX(number) '
+                                    'FROM messages').fetchone()[0] or 0
+        threshold = int(math.sqrt(limit * messages)) + 1
+        return all(self._db.execute('SELECT COUNT(*) FROM (%s LIMIT ?)'
+                                    % POSTINGS_QUERY,
+                                    (token, threshold)).fetchone()[0]
+                   >= threshold
+                   for token in tokens)
+
+    def refresh(self, roomIds=None, concurrency=None):
+        """Index the messages posted since the last refresh.
+
+        Rooms (all of the API's rooms, if roomIds is not given) are fetched
+        concurrently, each up to its last indexed message.
+        """
+        assert self.api is not None
+        if roomIds is None:
+            roomIds = [room.id for room in self.api.get_rooms()]
+        message_sync = MessageSync(self.api)
+        message_sync.marks = get_sync_state(self._db, 'message_marks')
+
+        def refresh_room(roomId):
+            mark = message_sync.marks.get(roomId)
+            messages = list(message_sync.new_messages(roomId))
+            try:
+                self.ingest(messages)
+            except Exception:
+                # Fetch the messages again next time
+                message_sync.restore_mark(roomId, mark)
+                raise
+
+        try:
+            for _ in self.api.map(refresh_room, roomIds,
+                                  concurrency=concurrency):
+                pass
+        finally:
+            # Rooms are only marked once their messages are indexed
+            set_sync_state(self._db, 'message_marks', message_sync.marks)
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
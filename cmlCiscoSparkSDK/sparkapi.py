@@ -1,13 +1,20 @@
 """@cmlccie Cisco Spark Python SDK."""
 from __future__ import absolute_import
 from builtins import object
+from past.builtins import basestring
 
 from datetime import datetime
 
 import pytz
 
+from .cache import LookupCache, CACHED_RESOURCES, CREATED, UPDATED, DELETED
+from .concurrency import BatchLoader, concurrent_map, with_deadline, \
+    DEFAULT_CONCURRENCY
+from .hedging import HedgingPolicy
 from .jsondata import JSONData, READ_ONLY, READ_WRITE
-from .restapi import RESTfulAPI
+from .ratelimit import RateLimiter
+from .restapi import RESTfulAPI, AdaptivePageSize, AUTO_PAGE_SIZE
+from .scheduling import AdaptiveConcurrencyLimiter
 
 
 # Module constants
@@ -19,6 +26,9 @@ MESSAGES_URL = 'messages'
 TEAMS_URL = 'teams'
 TEAM_MEMBERSHIPS_URL = 'team/memberships'
 WEBHOOKS_URL = 'webhooks'
+PEOPLE_ID_FILTER_MAX = 85
+PERSON_BATCH_WINDOW = 0.01
+SPARK_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 GET_EXPECTED_STATUS_CODE = 200
 POST_EXPECTED_STATUS_CODE = 200
 PUT_EXPECTED_STATUS_CODE = 200
@@ -27,10 +37,14 @@ DELETE_EXPECTED_STATUS_CODE = 204
 
 # Helper functions
 def spark_datetime(datetime_str):
-    return datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M:%S.%fZ')\
+    return datetime.strptime(datetime_str, SPARK_DATETIME_FORMAT)\
                     .replace(tzinfo=pytz.utc)
 
 
+def spark_datetime_str(value):
+    return value.astimezone(pytz.utc).strftime(SPARK_DATETIME_FORMAT)
+
+
 # Helper classes
 class SparkDateTime(object):
     def __init__(self, name, internal_attr_name=None):
@@ -131,21 +145,200 @@ class Webhook(SparkDataObject):
     data = None
 
 
+# Paginated listings
+class JSONItemsIterator(object):
+    """Iterator over the 'items' of a paginated Cisco Spark listing.
+
+    checkpoint() returns a JSON-serializable dictionary recording the
+    position reached (the URL of the current, or next, page and the number
+    of its items already yielded); pass it back to a listing method as
+    `checkpoint` to resume iteration from that position, for example after
+    a process restart.
+
+    If the 'max' parameter is 'auto' or an AdaptivePageSize, the page size
+    is tuned for each page from the latency and size of the previous one.
+    `limit` caps the total number of items yielded, independently of the
+    page size; the last page requested is sized to what is still needed
+    and no page is requested once the limit is reached.
+    """
+    def __init__(self, api, url, params=None, return_type=dict,
+                 deadline=None, checkpoint=None, limit=None):
+        self._api = api
+        self._return_type = return_type
+        self._limit = limit
+        self._yielded = 0
+        if checkpoint:
+            url = checkpoint['url']
+            params = checkpoint.get('params')
+            self._skip = checkpoint.get('offset', 0)
+        else:
+            self._skip = 0
+        self._page_size = None
+        if params and (params.get('max') == AUTO_PAGE_SIZE
+                       or isinstance(params.get('max'), AdaptivePageSize)):
+            # Tune the page size of each page as the listing is fetched
+            params = params.copy()
+            self._page_size = params['max']
+            if self._page_size == AUTO_PAGE_SIZE:
+                self._page_size = AdaptivePageSize()
+            params['max'] = self._page_size.size
+        if limit is not None and params is not None:
+            # Don't fetch more on the first page than needed
+            params = params.copy()
+            params['max'] = min(params.get('max') or limit, limit + self._skip)
+        self._cache_resource = None
+        if api.cache is not None and url in CACHED_RESOURCES:
+            self._cache_resource = url
+        self._start = {'url': url, 'params': params, 'offset': self._skip}
+        self._responses = api.get_iter(url, params=params, deadline=deadline,
+                                       next_page_size=self._next_page_size)
+        self._response = None
+        self._items = []
+        self._offset = 0
+        self._done = False
+
+    def _next_page_size(self, latency, num_bytes):
+        size = None
+        if self._page_size is not None:
+            size = self._page_size.update(latency, num_bytes)
+        if self._limit is not None:
+            remaining = self._limit - self._yielded
+            if size is not None:
+                size = min(size, remaining)
+            elif remaining < len(self._items):
+                size = remaining
+        return size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._limit is not None and self._yielded >= self._limit:
+            # Never request a page past the limit
+            self._done = True
+            self._responses.close()
+            raise StopIteration
+        while self._offset >= len(self._items):
+            if self._done:
+                raise StopIteration
+            self._next_page()
+        item = self._items[self._offset]
+        self._offset += 1
+        self._yielded += 1
+        return self._api._format_return(item, self._return_type)
+
+    def _next_page(self):
+        try:
+            response = next(self._responses)
+        except StopIteration:
+            self._done = True
+            raise
+        items = []
+        if response.status_code != GET_EXPECTED_STATUS_CODE:
+            response.raise_for_status()
+        else:
+            json_data = response.json()
+            if 'items' in json_data:
+                items = json_data.get('items')
+            else:
+                raise CMLSparkException("'items' object not found in JSON"
+                                        "data: %r" % json_data)
+        if items and self._cache_resource:
+            self._api.cache.put_many(self._cache_resource, items)
+        self._response = response
+        self._items = items
+        self._offset = min(self._skip, len(items))
+        self._skip = 0
+        if not items or not response.links.get('next'):
+            self._done = True
+
+    def checkpoint(self):
+        if self._response is None:
+            return dict(self._start)
+        next_link = self._response.links.get('next')
+        if next_link and self._offset >= len(self._items):
+            return {'url': next_link['url'], 'params': None, 'offset': 0}
+        return {'url': self._response.url, 'params': None,
+                'offset': self._offset}
+
+
 # Cisco Spark API methods container class
 class CiscoSparkAPI(RESTfulAPI):
     def __init__(self, authentication_token, api_url=DEFAULT_API_URL,
-                 timeout=None):
-        super(CiscoSparkAPI, self).__init__(api_url)
+                 timeout=None, wait_on_rate_limit=True,
+                 max_requests_per_second=None, adaptive_concurrency=False,
+                 hedging=False, rate_limiter=None, cache=None,
+                 page_cache=None):
+        if rate_limiter is None \
+                and (wait_on_rate_limit or max_requests_per_second):
+            rate_limiter = RateLimiter(rate=max_requests_per_second)
+            if not wait_on_rate_limit:
+                rate_limiter.max_retries = 0
+        concurrency_limiter = None
+        if adaptive_concurrency:
+            if isinstance(adaptive_concurrency, AdaptiveConcurrencyLimiter):
+                concurrency_limiter = adaptive_concurrency
+            else:
+                concurrency_limiter = AdaptiveConcurrencyLimiter()
+        hedging_policy = None
+        if hedging:
+            if isinstance(hedging, HedgingPolicy):
+                hedging_policy = hedging
+            else:
+                hedging_policy = HedgingPolicy()
+        super(CiscoSparkAPI, self).__init__(
+            api_url, rate_limiter=rate_limiter,
+            concurrency_limiter=concurrency_limiter,
+            hedging_policy=hedging_policy, page_cache=page_cache)
         self.authentication_token = authentication_token
         self.request_args['timeout'] = timeout
         self.request_args['headers'] = {
             'Authorization': 'Bearer ' + self.authentication_token}
+        self.cache = cache
+        self.change_listeners = [cache] if cache is not None else []
+        self.person_loader = BatchLoader(self._get_people_json_by_id,
+                                         max_batch_size=PEOPLE_ID_FILTER_MAX,
+                                         batch_window=PERSON_BATCH_WINDOW)
+        self.email_resolver = LookupCache(self._get_person_json_by_email)
 
     def delete(self, url, **request_args):
         response = super(CiscoSparkAPI, self).delete(url, **request_args)
         if response.status_code != DELETE_EXPECTED_STATUS_CODE:
             response.raise_for_status()
 
+    def map(self, method, iterable_of_args, concurrency=None, ordered=True,
+            return_exceptions=False, deadline=None):
+        """Concurrently call an API method once for each item of arguments.
+
+        method may be a method of this object or its name, for example
+        api.map('delete_message', message_ids).  Each item is passed as
+        positional args (tuple), keyword args (dict) or a single argument.
+        Requests share this object's rate limiter, so all workers pause
+        together when Cisco Spark returns a 429.  If concurrency is not
+        given it defaults to DEFAULT_CONCURRENCY or, with adaptive
+        concurrency enabled, to enough workers for the limiter's maximum
+        limit; the limiter then controls how many are actually in flight.
+        If a deadline is given, no further calls are started, and results
+        are no longer waited for, once it expires; it is also passed to
+        methods that take a deadline (e.g. listings), so that calls still
+        running stop there too.
+        """
+        if not callable(method):
+            method = getattr(self, method)
+        if concurrency is None:
+            concurrency = self._bulk_concurrency()
+        method = with_deadline(method, deadline)
+        return concurrent_map(method, iterable_of_args,
+                              concurrency=concurrency, ordered=ordered,
+                              return_exceptions=return_exceptions,
+                              deadline=deadline)
+
+    def _bulk_concurrency(self):
+        if self.concurrency_limiter:
+            return self.concurrency_limiter.max_limit
+        else:
+            return DEFAULT_CONCURRENCY
+
     def _format_return(self, json_dict, return_type):
         if issubclass(return_type, SparkDataObject):
             return return_type(json_dict, api=self)
@@ -164,24 +357,26 @@ class CiscoSparkAPI(RESTfulAPI):
             json_data = response.json()
             return json_data
 
-    def get_json_items(self, url, params=None):
-        responses = self.get_iter(url, params=params)
-        for response in responses:
-            items = []
-            if response.status_code != GET_EXPECTED_STATUS_CODE:
-                response.raise_for_status()
-            else:
-                json_data = response.json()
-                if json_data.get('items'):
-                    items = json_data.get('items')
-                else:
-                    raise CMLSparkException("'items' object not found in JSON"
-                                            "data: %r" % json_data)
-            if items:
-                for item in items:
-                    yield item
-            else:
-                raise StopIteration
+    def _get_entity_json(self, resource, id):
+        # Get an object's JSON by id, from the cache if possible
+        if self.cache is not None:
+            json_dict = self.cache.get(resource, id)
+            if json_dict is not None:
+                return json_dict
+        json_dict = self.get_json(resource + '/' + id)
+        if self.cache is not None:
+            self.cache.put(resource, json_dict)
+        return json_dict
+
+    def _notify_change(self, resource, event, data):
+        for listener in self.change_listeners:
+            listener.apply_change(resource, event, data)
+
+    def get_json_items(self, url, params=None, return_type=dict,
+                       deadline=None, checkpoint=None, limit=None):
+        return JSONItemsIterator(self, url, params=params,
+                                 return_type=return_type, deadline=deadline,
+                                 checkpoint=checkpoint, limit=limit)
 
     def post_json(self, url, json_dict):
         response = self.post(url, json=json_dict)
@@ -197,60 +392,145 @@ class CiscoSparkAPI(RESTfulAPI):
         else:
             return response.json()
 
-    def get_people(self, email=None, displayName=None, max=None,
-                   return_type=Person):
+    def get_people(self, email=None, displayName=None, max=None, id=None,
+                   return_type=Person, deadline=None, checkpoint=None,
+                   limit=None):
         params = {}
         if email:
             params['email'] = email
         elif displayName:
             params['displayName'] = displayName
+        elif id:
+            if not isinstance(id, basestring):
+                assert len(id) <= PEOPLE_ID_FILTER_MAX
+                id = ','.join(id)
+            params['id'] = id
         else:
             raise CMLSparkException('')
         if max:
             params['max'] = max
-        people_items = self.get_json_items(PEOPLE_URL, params=params)
-        for item in people_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(PEOPLE_URL, params=params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def get_person(self, id, return_type=Person):
-        json_dict = self.get_json(PEOPLE_URL + '/' + id)
+        json_dict = self._get_entity_json(PEOPLE_URL, id)
+        return self._format_return(json_dict, return_type)
+
+    def _get_people_json_by_id(self, ids):
+        people = {}
+        for i in range(0, len(ids), PEOPLE_ID_FILTER_MAX):
+            chunk = ids[i:i + PEOPLE_ID_FILTER_MAX]
+            params = {'id': ','.join(chunk), 'max': len(chunk)}
+            for item in self.get_json_items(PEOPLE_URL, params=params):
+                people[item['id']] = item
+        return people
+
+    def get_person_batched(self, id, return_type=Person):
+        """Get a person, batching the lookup with other concurrent lookups.
+
+        Lookups made from any thread within a short window are resolved
+        together with a single people listing request (filtered by id).
+        """
+        if self.cache is not None:
+            json_dict = self.cache.get(PEOPLE_URL, id)
+            if json_dict is not None:
+                return self._format_return(json_dict, return_type)
+        try:
+            json_dict = self.person_loader.load(id)
+        except KeyError:
+            raise CiscoSparkException("Person not found: %r" % id)
+        return self._format_return(json_dict, return_type)
+
+    def get_people_batched(self, ids, return_type=Person):
+        futures = [(id, self.person_loader.submit(id)) for id in ids]
+        people = []
+        for id, future in futures:
+            try:
+                json_dict = future.result()
+            except KeyError:
+                raise CiscoSparkException("Person not found: %r" % id)
+            people.append(self._format_return(json_dict, return_type))
+        return people
+
+    def _get_person_json_by_email(self, email):
+        params = {'email': email}
+        for item in self.get_json_items(PEOPLE_URL, params=params, limit=1):
+            return item
+        return None
+
+    def resolve_email(self, email, return_type=Person):
+        """Get the person with an email address, or None if there is none.
+
+        Results, including unknown addresses, are cached by
+        self.email_resolver; see its metrics() for hit rates.
+        """
+        json_dict = self.email_resolver.get(email.lower())
+        if json_dict is None:
+            return None
         return self._format_return(json_dict, return_type)
 
+    def resolve_emails(self, emails, concurrency=None, return_type=Person):
+        """Resolve email addresses to people, concurrently.
+
+        Returns a dictionary mapping each address to a person, or to None
+        for unknown addresses.
+        """
+        if concurrency is None:
+            concurrency = self._bulk_concurrency()
+        emails = list(emails)
+        resolved = self.email_resolver.get_many(
+            [email.lower() for email in emails], concurrency=concurrency)
+        people = {}
+        for email in emails:
+            json_dict = resolved[email.lower()]
+            people[email] = None if json_dict is None \
+                else self._format_return(json_dict, return_type)
+        return people
+
     def get_person_me(self, return_type=Person):
         json_dict = self.get_json(PEOPLE_URL + '/me')
         return self._format_return(json_dict, return_type)
 
-    def get_rooms(self, showSipAddress=False, max=None, return_type=Room):
+    def get_rooms(self, showSipAddress=False, max=None, return_type=Room,
+                  deadline=None, checkpoint=None, limit=None):
         params = {'showSipAddress': showSipAddress}
         if max:
             params['max'] = max
-        room_items = self.get_json_items(ROOMS_URL, params=params)
-        for item in room_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(ROOMS_URL, params=params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def create_room(self, title, return_type=Room):
         json_payload_dict = {'title': title}
         json_dict = self.post_json(ROOMS_URL, json_payload_dict)
+        self._notify_change(ROOMS_URL, CREATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def get_room(self, id, showSipAddress=False, return_type=Room):
-        params = {}
         if showSipAddress:
-            params['showSipAddress'] = showSipAddress
-        json_dict = self.get_json(ROOMS_URL+'/'+id, params)
+            params = {'showSipAddress': showSipAddress}
+            json_dict = self.get_json(ROOMS_URL+'/'+id, params)
+        else:
+            json_dict = self._get_entity_json(ROOMS_URL, id)
         return self._format_return(json_dict, return_type)
 
     def update_room(self, id, return_type=Room, **attributes):
         assert attributes
         json_payload_dict = attributes
         json_dict = self.put_json(ROOMS_URL+'/'+id, json_payload_dict)
+        self._notify_change(ROOMS_URL, UPDATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def delete_room(self, id):
         self.delete(ROOMS_URL+'/'+id)
+        self._notify_change(ROOMS_URL, DELETED, {'id': id})
 
     def get_memberships(self, roomId, personId=None, personEmail=None,
-                        max=None, return_type=Membership):
+                        max=None, return_type=Membership, deadline=None,
+                        checkpoint=None, limit=None):
         params = {'roomId': roomId}
         if personId:
             params['personId'] = personId
@@ -258,9 +538,10 @@ class CiscoSparkAPI(RESTfulAPI):
             params['personEmail'] = personEmail
         if max:
             params['max'] = max
-        membership_items = self.get_json_items(MEMBERSHIPS_URL, params)
-        for item in membership_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(MEMBERSHIPS_URL, params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def create_membership(self, roomId, personId=None, personEmail=None,
                           isModerator=False, return_type=Membership):
@@ -272,23 +553,27 @@ class CiscoSparkAPI(RESTfulAPI):
         else:
             raise CMLSparkException
         json_dict = self.post_json(MEMBERSHIPS_URL, json_payload_dict)
+        self._notify_change(MEMBERSHIPS_URL, CREATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def get_membership(self, id, return_type=Membership):
-        json_dict = self.get_json(MEMBERSHIPS_URL+'/'+id)
+        json_dict = self._get_entity_json(MEMBERSHIPS_URL, id)
         return self._format_return(json_dict, return_type)
 
     def update_membership(self, id, return_type=Membership, **attributes):
         assert attributes
         json_payload_dict = attributes
         json_dict = self.put_json(MEMBERSHIPS_URL+'/'+id, json_payload_dict)
+        self._notify_change(MEMBERSHIPS_URL, UPDATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def delete_membership(self, id):
         self.delete(MEMBERSHIPS_URL+'/'+id)
+        self._notify_change(MEMBERSHIPS_URL, DELETED, {'id': id})
 
     def get_messages(self, roomId, before=None, beforeMessage=None, max=None,
-                     return_type=Message):
+                     return_type=Message, deadline=None, checkpoint=None,
+                     limit=None):
         params = {'roomId': roomId}
         if before:
             params['before'] = before
@@ -296,9 +581,10 @@ class CiscoSparkAPI(RESTfulAPI):
             params['beforeMessage'] = beforeMessage
         if max:
             params['max'] = max
-        message_items = self.get_json_items(MESSAGES_URL, params)
-        for item in message_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(MESSAGES_URL, params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def create_message(self, roomId=None, text=None, files=None,
                        toPersonId=None, toPersonEmail=None, markdown=None,
@@ -321,6 +607,7 @@ class CiscoSparkAPI(RESTfulAPI):
         if markdown:
             json_payload_dict['markdown'] = markdown
         json_dict = self.post_json(MESSAGES_URL, json_payload_dict)
+        self._notify_change(MESSAGES_URL, CREATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def get_message(self, id, return_type=Message):
@@ -329,41 +616,49 @@ class CiscoSparkAPI(RESTfulAPI):
 
     def delete_message(self, id):
         self.delete(MESSAGES_URL+'/'+id)
+        self._notify_change(MESSAGES_URL, DELETED, {'id': id})
 
-    def get_teams(self, max=None, return_type=Team):
+    def get_teams(self, max=None, return_type=Team, deadline=None,
+                  checkpoint=None, limit=None):
         params = {}
         if max:
             params['max'] = max
-        team_items = self.get_json_items(TEAMS_URL, params=params)
-        for item in team_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(TEAMS_URL, params=params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def create_team(self, name, return_type=Team):
         json_payload_dict = {'name': name}
         json_dict = self.post_json(TEAMS_URL, json_payload_dict)
+        self._notify_change(TEAMS_URL, CREATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def get_team(self, id, return_type=Team):
-        json_dict = self.get_json(TEAMS_URL+'/'+id)
+        json_dict = self._get_entity_json(TEAMS_URL, id)
         return self._format_return(json_dict, return_type)
 
     def update_team(self, id, return_type=Team, **attributes):
         assert attributes
         json_payload_dict = attributes
         json_dict = self.put_json(TEAMS_URL+'/'+id, json_payload_dict)
+        self._notify_change(TEAMS_URL, UPDATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def delete_team(self, id):
         self.delete(TEAMS_URL+'/'+id)
+        self._notify_change(TEAMS_URL, DELETED, {'id': id})
 
     def get_team_memberships(self, teamId, max=None,
-                             return_type=TeamMembership):
+                             return_type=TeamMembership, deadline=None,
+                             checkpoint=None, limit=None):
         params = {'teamId': teamId}
         if max:
             params['max'] = max
-        membership_items = self.get_json_items(TEAM_MEMBERSHIPS_URL, params)
-        for item in membership_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(TEAM_MEMBERSHIPS_URL, params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def create_team_membership(self, teamId, personId=None, personEmail=None,
                                isModerator=False, return_type=TeamMembership):
@@ -375,6 +670,7 @@ class CiscoSparkAPI(RESTfulAPI):
         else:
             raise CMLSparkException
         json_dict = self.post_json(TEAM_MEMBERSHIPS_URL, json_payload_dict)
+        self._notify_change(TEAM_MEMBERSHIPS_URL, CREATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def get_team_membership(self, id, return_type=TeamMembership):
@@ -385,19 +681,24 @@ class CiscoSparkAPI(RESTfulAPI):
                                **attributes):
         assert attributes
         json_payload_dict = attributes
-        json_dict = self.put_json(TeamMembership+'/'+id, json_payload_dict)
+        json_dict = self.put_json(TEAM_MEMBERSHIPS_URL+'/'+id,
+                                  json_payload_dict)
+        self._notify_change(TEAM_MEMBERSHIPS_URL, UPDATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def delete_team_membership(self, id):
         self.delete(TEAM_MEMBERSHIPS_URL + '/' + id)
+        self._notify_change(TEAM_MEMBERSHIPS_URL, DELETED, {'id': id})
 
-    def get_webhooks(self, max=None, return_type=Webhook):
+    def get_webhooks(self, max=None, return_type=Webhook, deadline=None,
+                     checkpoint=None, limit=None):
         params = {}
         if max:
             params['max'] = max
-        webhook_items = self.get_json_items(WEBHOOKS_URL, params)
-        for item in webhook_items:
-            yield self._format_return(item, return_type)
+        return self.get_json_items(WEBHOOKS_URL, params,
+                                   return_type=return_type,
+                                   deadline=deadline, checkpoint=checkpoint,
+                                   limit=limit)
 
     def create_webhook(self, name, targetUrl, resource, event, filter, secret=None,
                        return_type=Webhook):
@@ -409,6 +710,7 @@ class CiscoSparkAPI(RESTfulAPI):
         if secret:
             json_payload_dict['secret'] = secret
         json_dict = self.post_json(WEBHOOKS_URL, json_payload_dict)
+        self._notify_change(WEBHOOKS_URL, CREATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def get_webhook(self, id, return_type=Webhook):
@@ -419,7 +721,9 @@ class CiscoSparkAPI(RESTfulAPI):
         assert attributes
         json_payload_dict = attributes
         json_dict = self.put_json(WEBHOOKS_URL+'/'+id, json_payload_dict)
+        self._notify_change(WEBHOOKS_URL, UPDATED, json_dict)
         return self._format_return(json_dict, return_type)
 
     def delete_webhook(self, id):
         self.delete(WEBHOOKS_URL+'/'+id)
+        self._notify_change(WEBHOOKS_URL, DELETED, {'id': id})
@@ -0,0 +1,63 @@
+"""SQLite database access shared by threads and processes."""
+from __future__ import absolute_import
+from builtins import object
+
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import threading
+
+
+# Module constants
+SQLITE_LOCK_TIMEOUT = 30
+SYNC_STATE_TABLE = ('CREATE TABLE IF NOT EXISTS sync_state ('
+                    'name TEXT PRIMARY KEY, json TEXT)')
+
+
+# Helper functions
+def get_sync_state(db, name):
+    """Read a JSON value from a database's sync_state table ({} if unset)."""
+    row = db.execute('SELECT json FROM sync_state WHERE name = ?',
+                     (name,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def set_sync_state(db, name, json_data):
+    db.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?)',
+               (name, json.dumps(json_data)))
+
+
+class SQLiteDatabase(object):
+    """A SQLite database file, with one connection per thread and process.
+
+    Connections are in autocommit mode; use transaction() to group
+    statements under an exclusive (BEGIN IMMEDIATE) transaction.
+    """
+    def __init__(self, path, timeout=SQLITE_LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connection(self):
+        # Reopened in forked child processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=self.timeout,
+                                             isolation_level=None)
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def execute(self, sql, parameters=()):
+        return self.connection().execute(sql, parameters)
+
+    @contextmanager
+    def transaction(self):
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        else:
+            db.execute('COMMIT')
@@ -0,0 +1,208 @@
+"""Incremental synchronization of Cisco Spark data."""
+from __future__ import absolute_import
+from builtins import object
+from past.builtins import basestring
+
+import json
+import os
+import threading
+
+from .fileio import atomic_file
+from .sparkapi import Message, spark_datetime, spark_datetime_str
+
+
+# Module constants
+DEFAULT_SYNC_PAGE_SIZE = 50
+
+
+# Helper functions
+def load_json_file(path, default):
+    if path is None or not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json_file(path, json_data):
+    """Atomically replace the file at path with json_data."""
+    with atomic_file(path) as f:
+        json.dump(json_data, f)
+
+
+def marks_path(path):
+    """The message marks file kept next to a sync snapshot file, if any."""
+    if path is None:
+        return None
+    root, ext = os.path.splitext(path)
+    return root + '-marks' + (ext or '.json')
+
+
+def message_mark(message):
+    """The id and created time of a message (or a message's JSON dict)."""
+    if isinstance(message, dict):
+        created = message['created']
+        if not isinstance(created, basestring):
+            created = spark_datetime_str(created)
+        return {'id': message['id'], 'created': created}
+    return {'id': message.id, 'created': spark_datetime_str(message.created)}
+
+
+class MessageSync(object):
+    """Fetch only the messages posted since the last sync, room by room.
+
+    For each room, the newest message already seen (its id and created
+    time) is kept as a high-water mark.  new_messages() walks get_messages
+    newest-first and stops as soon as it reaches the mark, so a room with
+    no new messages costs a single small page.  Marks are updated, and
+    saved atomically to `path` (a JSON file) if given, only once a room's
+    new messages have all been yielded, unless the caller saves them
+    itself (see new_messages).
+    """
+    def __init__(self, api, path=None, page_size=DEFAULT_SYNC_PAGE_SIZE,
+                 return_type=Message):
+        self.api = api
+        self.path = path
+        self.page_size = page_size
+        self.return_type = return_type
+        self.marks = load_json_file(path, {})
+        self._lock = threading.RLock()
+
+    def new_messages(self, roomId, save_mark=True):
+        """Yield the room's messages newer than its mark, newest first.
+
+        With save_mark=False the mark is left alone; call update_mark with
+        the message_mark of the first message once they have been handled.
+        """
+        mark = self.marks.get(roomId)
+        mark_created = spark_datetime(mark['created']) if mark else None
+        newest = None
+        messages = self.api.get_messages(roomId, max=self.page_size,
+                                         return_type=self.return_type)
+        for message in messages:
+            this_mark = message_mark(message)
+            if mark and (this_mark['id'] == mark['id']
+                         or spark_datetime(this_mark['created'])
+                         < mark_created):
+                break
+            if newest is None:
+                newest = this_mark
+            yield message
+        if newest and save_mark:
+            self.update_mark(roomId, newest)
+
+    def sync_rooms(self, roomIds):
+        """Yield the new messages of each room in turn."""
+        for roomId in roomIds:
+            for message in self.new_messages(roomId):
+                yield message
+
+    def update_mark(self, roomId, mark):
+        with self._lock:
+            self.marks[roomId] = mark
+            self.save()
+
+    def restore_mark(self, roomId, mark):
+        """Put back a mark read before new_messages (None if it had none)."""
+        with self._lock:
+            if mark is None:
+                self.marks.pop(roomId, None)
+            else:
+                self.marks[roomId] = mark
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if self.path is not None:
+                save_json_file(self.path, self.marks)
+
+
+class SyncReport(object):
+    """The outcome of a WorkspaceSync.sync() run."""
+    def __init__(self):
+        self.refreshed = []
+        self.skipped = []
+        self.failed = {}
+
+    def __repr__(self):
+        return '<SyncReport refreshed=%d skipped=%d failed=%d>' % \
+            (len(self.refreshed), len(self.skipped), len(self.failed))
+
+
+class WorkspaceSync(object):
+    """Refresh only the rooms that have had activity since the last sync.
+
+    Each sync() snapshots get_rooms and compares each room's lastActivity
+    with the previous snapshot (kept in the JSON file at `path`, if given,
+    with the message marks next to it; see marks_path).
+    Only changed rooms are refreshed, concurrently through api.map: their
+    new messages are fetched with a MessageSync and their memberships are
+    listed, and both are passed to the on_messages(room, messages) and
+    on_memberships(room, memberships) callbacks.  The snapshot's rooms are
+    passed to on_rooms(rooms) first, if given.  Rooms that fail to
+    refresh, including when a callback raises, keep their previous
+    snapshot and message mark, so they are retried next time: a room's
+    mark is only moved on once its callbacks have returned.
+    """
+    def __init__(self, api, path=None, message_sync=None, on_messages=None,
+                 on_memberships=None, concurrency=None, on_rooms=None):
+        self.api = api
+        self.path = path
+        if message_sync is None:
+            message_sync = MessageSync(api, marks_path(path))
+        self.message_sync = message_sync
+        self.on_messages = on_messages
+        self.on_memberships = on_memberships
+        self.on_rooms = on_rooms
+        self.concurrency = concurrency
+        self.snapshot = load_json_file(path, {})
+
+    def refresh_room(self, room):
+        messages = list(self.message_sync.new_messages(room.id,
+                                                       save_mark=False))
+        if self.on_messages:
+            self.on_messages(room, messages)
+        memberships = list(self.api.get_memberships(room.id))
+        if self.on_memberships:
+            self.on_memberships(room, memberships)
+        if messages:
+            self.message_sync.update_mark(room.id, message_mark(messages[0]))
+
+    def _refresh(self, room):
+        try:
+            self.refresh_room(room)
+        except Exception as e:
+            return room, e
+        return room, None
+
+    def sync(self):
+        report = SyncReport()
+        snapshot = {}
+        changed = []
+        rooms = list(self.api.get_rooms())
+        if self.on_rooms:
+            self.on_rooms(rooms)
+        for room in rooms:
+            last_activity = getattr(room, 'lastActivity', None)
+            if last_activity is not None:
+                last_activity = spark_datetime_str(last_activity)
+            snapshot[room.id] = last_activity
+            if last_activity is None \
+                    or self.snapshot.get(room.id) != last_activity:
+                changed.append(room)
+            else:
+                report.skipped.append(room.id)
+        results = self.api.map(self._refresh, changed,
+                               concurrency=self.concurrency, ordered=False)
+        for room, exception in results:
+            if exception is None:
+                report.refreshed.append(room.id)
+            else:
+                report.failed[room.id] = exception
+                if room.id in self.snapshot:
+                    snapshot[room.id] = self.snapshot[room.id]
+                else:
+                    del snapshot[room.id]
+        self.snapshot = snapshot
+        if self.path is not None:
+            save_json_file(self.path, snapshot)
+        return report
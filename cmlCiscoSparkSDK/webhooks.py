@@ -0,0 +1,104 @@
+"""Handling of Cisco Spark webhook notifications."""
+from __future__ import absolute_import
+from builtins import object
+from past.builtins import basestring
+
+import hashlib
+import hmac
+import json
+
+from .cache import DELETED
+from .jsondata import JSONData
+from .sparkapi import Webhook, ROOMS_URL, MEMBERSHIPS_URL, MESSAGES_URL, \
+    TEAMS_URL, TEAM_MEMBERSHIPS_URL
+
+
+# Module constants
+# Webhook resource names, and the API resources they notify changes to
+WEBHOOK_RESOURCES = {
+    'rooms': ROOMS_URL,
+    'memberships': MEMBERSHIPS_URL,
+    'messages': MESSAGES_URL,
+    'teams': TEAMS_URL,
+    'teamMemberships': TEAM_MEMBERSHIPS_URL,
+}
+# Resources whose notifications carry only part of the object's data
+PARTIAL_DATA_RESOURCES = (MESSAGES_URL,)
+SIGNATURE_HEADER = 'X-Spark-Signature'
+
+
+# Helper functions
+def webhook_signature(secret, body):
+    """The HMAC-SHA1 signature Cisco Spark sends for a body (bytes)."""
+    if not isinstance(secret, bytes):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, body, hashlib.sha1).hexdigest()
+
+
+def verify_signature(secret, body, signature):
+    """Whether signature (the X-Spark-Signature header) matches the body.
+
+    The comparison takes constant time, so it doesn't leak how much of a
+    forged signature is correct.
+    """
+    if not signature:
+        return False
+    if isinstance(signature, bytes):
+        signature = signature.decode('ascii', 'replace')
+    return hmac.compare_digest(webhook_signature(secret, body),
+                               str(signature.strip().lower()))
+
+
+def parse_webhook(payload, return_type=Webhook):
+    """Parse a webhook notification (JSON string, dict or Webhook)."""
+    if isinstance(payload, Webhook):
+        return payload
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    if isinstance(payload, basestring):
+        payload = json.loads(payload)
+    return return_type(payload)
+
+
+class WebhookInvalidator(object):
+    """Keep client-side caches current from webhook notifications.
+
+    Each notification is applied to every listener (any object with an
+    apply_change(resource, event, data) method, such as SQLiteCache,
+    WorkspaceMirror or MembershipIndex): deleted objects are removed and
+    created or updated objects are patched with the notification's data.
+    Message notifications carry only part of the message, so the message is
+    fetched through the API if one is given and otherwise invalidated
+    (removed) rather than patched.  So caches can use long TTLs safely.
+
+    If listeners is not given, the API's change_listeners are used; so
+    everything kept current with changes made through the API is also kept
+    current with changes made by others.
+    """
+    def __init__(self, listeners=None, api=None):
+        assert listeners is not None or api is not None
+        self.listeners = listeners if listeners is not None \
+            else api.change_listeners
+        self.api = api
+        self.applied = 0
+        self.ignored = 0
+
+    def handle(self, payload):
+        """Apply a webhook notification; returns False if not applicable."""
+        webhook = parse_webhook(payload)
+        resource = WEBHOOK_RESOURCES.get(webhook.resource)
+        data = webhook.data
+        if resource is None or not isinstance(data, JSONData):
+            self.ignored += 1
+            return False
+        event = webhook.event
+        data = data._json_dict()
+        if event != DELETED and resource in PARTIAL_DATA_RESOURCES:
+            if self.api is not None:
+                data = self.api.get_json(resource + '/' + data['id'])
+            else:
+                event = DELETED
+        for listener in self.listeners:
+            listener.apply_change(resource, event, data)
+        self.applied += 1
+        return True
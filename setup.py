@@ -22,7 +22,8 @@ setup(name='cmlCiscoSparkSDK',
       license='MIT',
       version=versioneer.get_version(),
       cmdclass=versioneer.get_cmdclass(),
-      install_requires=['requests', 'pytz','future'],
+      install_requires=['requests', 'pytz', 'future',
+                        'futures; python_version < "3"'],
       packages=['cmlCiscoSparkSDK'],
       classifiers=['Development Status :: 3 - Alpha'],
      )
@@ -0,0 +1,53 @@
+"""Tests for rate limiting shared across processes."""
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import time
+
+from cmlCiscoSparkSDK import SharedRateLimiter
+
+
+# Module constants
+RATE = 20
+BURST = 5
+PROCESSES = 4
+DURATION = 3.0
+
+
+# Helper functions
+def take_tokens(path, start, results):
+    limiter = SharedRateLimiter(path, rate=RATE, burst=BURST)
+    times = []
+    while True:
+        limiter.wait()
+        now = time.time()
+        if now - start >= DURATION:
+            break
+        times.append(now)
+    results.put(times)
+
+
+def test_shared_rate_limiter_aggregate_rate(tmp_path):
+    path = os.path.join(str(tmp_path), 'ratelimit.db')
+    # Create the shared state before the workers race to
+    SharedRateLimiter(path, rate=RATE, burst=BURST)
+    results = multiprocessing.Queue()
+    start = time.time()
+    processes = [multiprocessing.Process(target=take_tokens,
+                                         args=(path, start, results))
+                 for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    shares = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    times = sorted(t for share in shares for t in share)
+
+    # Every process got a share, and together they kept to the limit
+    assert all(shares)
+    assert len(times) >= RATE * (DURATION - 1)
+    assert len(times) <= RATE * DURATION + BURST
+    for index, window_start in enumerate(times):
+        in_window = sum(1 for t in times[index:] if t < window_start + 1)
+        assert in_window <= RATE + BURST